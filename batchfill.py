@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+filling a whole batch of puzzles, with the words loaded only once
+"""
+
+import os
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wordindex import Wordindex
+from nogoods import Nogoodcache
+from filler import Filler
+from puzzlestate import Puzzlestate
+from slotgeometry import Slotgeometry
+from fillstats import Fillstats
+
+# set in each worker process by _initbatchworker()
+_batch = {}
+
+def outputname(infilename):
+  '''where the filled copy of infilename goes: foo.ipuz -> foo-out.ipuz'''
+  if infilename.rfind('.ipuz') == -1:
+    return infilename + '-out.ipuz'
+  return (infilename[::-1].replace('zupi.','zupi.tuo-',1))[::-1]
+
+def batchinputs(source):
+  '''
+  The puzzle files in a batch.  source is either a directory, meaning
+  every .ipuz file in it, or a manifest: a text file naming one puzzle
+  file per line, relative to the manifest's own directory, with blank
+  lines and lines starting with # skipped.
+  '''
+  if os.path.isdir(source):
+    return [ os.path.join(source, name) for name in sorted(os.listdir(source))
+             if name.endswith('.ipuz') ]
+  try:
+    with open(source, encoding='utf-8') as f:
+      lines = [ line.strip() for line in f ]
+  except OSError as e:
+    raise RuntimeError(f'Could not read the manifest {source}') from e
+  here = os.path.dirname(source)
+  return [ os.path.join(here, line) for line in lines
+           if line and not line.startswith('#') ]
+
+def fillone(infilename,outdir,wi,seed,nogoodsize=100000,geometrycache=None,stats=False,
+            timeout=None,max_nodes=None,stall=None,restarts=None,keepletters=False):
+  '''
+  Fill one puzzle with the words in wi and, if that works, write it to
+  outdir as json and as svg.  If it doesn't, because there is no fill
+  or because the search gave up first (see Filler.fill() for timeout,
+  max_nodes, stall and restarts), the best partial fill gets written
+  instead.  With keepletters, letters already in the puzzle's solution
+  stay put.  Returns a record of what happened, with the time it took,
+  and with stats, the search's Fillstats.
+  '''
+  started = time.perf_counter()
+  record = { 'infile': infilename, 'seed': seed, 'filled': False }
+  try:
+    # with a cached geometry, the puzzle itself only gets parsed if
+    # there is something to write to it, or letters to keep from it
+    data = Puzzlestate.readjson(infilename)
+    puzzle = None
+    if geometrycache is not None:
+      geometry = Slotgeometry.fromjson(data,infilename,cachedir=geometrycache)
+    else:
+      puzzle = geometry = Puzzlestate.fromjson(data,infilename)
+    givens = {}
+    if keepletters:
+      if puzzle is None:
+        puzzle = Puzzlestate.fromjson(data,infilename)
+      givens = puzzle.givenletters()
+    nogoods = None
+    if nogoodsize > 0:
+      nogoods = Nogoodcache(maxsize=nogoodsize)
+    filler = Filler(geometry,wi,nogoods=nogoods,seed=seed,
+                    stats=Fillstats() if stats else None,givens=givens)
+    changelist = filler.fill(timeout=timeout,max_nodes=max_nodes,stall=stall,restarts=restarts)
+    if changelist is None and filler.best:
+      changelist = filler.bestchangelist()
+      record.update(partial=len(changelist), slots=len(filler.prop.items))
+    if changelist is not None:
+      if puzzle is None:
+        puzzle = Puzzlestate.fromjson(data,infilename)
+      if 'partial' in record:
+        # only the givens, and what the search placed, belong in it
+        puzzle.clearletters().setletters(givens)
+      puzzle.populate_solution_from_changelist(changelist)
+      outfilename = os.path.join(outdir, os.path.basename(outputname(infilename)))
+      puzzle.writejson(outfilename)
+      puzzle.writesvg(outfilename[:-len('.ipuz')] + '.svg',
+                      showtitle=True,showcluenumbers=True,showsolvedcells=True)
+      record.update(filled='partial' not in record, outfile=outfilename)
+    record['nodes'] = filler.nodes
+    record['restarts'] = filler.restarts
+    if stats:
+      record['stats'] = filler.stats.asdict()
+  except Exception as e:
+    # one bad template shouldn't sink the rest of the batch, whatever
+    # is wrong with it
+    logging.warning("%s: %s: %s", infilename, type(e).__name__, e)
+    record['error'] = f'{type(e).__name__}: {e}'
+  record['seconds'] = time.perf_counter() - started
+  return record
+
+def _initbatchworker(wi,outdir,options):
+  # wi comes from the parent process, so the words only get read once
+  _batch.update(wi=wi, outdir=outdir, options=options)
+
+def batchworker(infilename,seed):
+  '''runs in a worker process: fillone() with the shared words'''
+  return fillone(infilename, _batch['outdir'], _batch['wi'], seed, **_batch['options'])
+
+def batchfill(infilenames,outdir,wi,jobs=1,seed=0,**options):
+  '''
+  Fill every puzzle in infilenames, using jobs worker processes that
+  share the one Wordindex wi, and write the results to outdir.  Puzzle
+  i gets seed+i, so a batch fills the same way however many jobs it
+  runs with.  The other options are fillone()'s.  Writes and returns
+  the list of per-puzzle records, in input order, in outdir/batch.json.
+  '''
+  assert isinstance(jobs,int) and jobs > 0, "jobs must be a positive integer"
+  if seed == 0:
+    seed = Wordindex.clockseed()
+  os.makedirs(outdir, exist_ok=True)
+
+  if jobs == 1:
+    records = [ fillone(infilename, outdir, wi, seed+i, **options)
+                for i, infilename in enumerate(infilenames) ]
+  else:
+    records = [ None ] * len(infilenames)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_initbatchworker,
+                             initargs=(wi, outdir, options)) as pool:
+      futures = { pool.submit(batchworker, infilename, seed+i): i
+                  for i, infilename in enumerate(infilenames) }
+      for future in as_completed(futures):
+        records[futures[future]] = future.result()
+
+  with open(os.path.join(outdir, 'batch.json'), 'w', encoding='utf-8') as f:
+    json.dump(records, f, indent=2)
+  return records
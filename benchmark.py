@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+how fast the filler is: fill a fixed set of grids with a fixed set of
+word lists and seeds, and compare the numbers with a saved baseline
+
+usage: benchmark.py [--save benchmark-baseline.json] [--baseline benchmark-baseline.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import unidecode
+from puzzlestate import Puzzlestate
+from wordindex import Wordindex
+from nogoods import Nogoodcache
+from filler import Filler, Restarts
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# grids from files; any solution in them gets thrown away, so the
+# filler starts from an empty grid
+GRIDFILES = {
+  'sator': 'sator.ipuz',
+  'baby-animals': 'samplepuzzles/baby-animals-crossword.ipuz',
+  'puzzazz-15x15': 'samplepuzzles/samplepuzzle.ipuz',
+}
+
+# made-up grids, as rows of cells, # for a barrier
+SYNTHETIC = {
+  'open-4x4': [ '....' ] * 4,
+  'open-5x5': [ '.....' ] * 5,
+  'open-6x6-corners': [ '#....#', '......', '......', '......', '......', '#....#' ],
+}
+
+DICTIONARIES = {
+  'english1020': 'wordstotry/english1020.txt',
+  'ordinary': 'wordstotry/ordinary.txt',
+  'words': 'words.txt',
+}
+
+SEEDS = [ 1, 2, 3 ]
+
+# anything quicker than this is too quick to compare speeds on
+MIN_SECONDS = 0.1
+
+def loadgrid(name):
+  if name in SYNTHETIC:
+    return Puzzlestate.fromjson(Puzzlestate.blankjson(SYNTHETIC[name]),name)
+  filename = os.path.join(HERE, GRIDFILES[name])
+  try:
+    with open(filename,encoding='utf-8') as f:
+      data = json.load(f)
+  except Exception as e:
+    raise RuntimeError(f'Could not read json from {filename}') from e
+  data.pop('solution',None)
+  return Puzzlestate.fromjson(data,filename)
+
+def loadwords(dictionary,seed):
+  filename = os.path.join(HERE, DICTIONARIES[dictionary])
+  try:
+    with open(filename,encoding='latin-1') as f:
+      # wordstotry/ordinary.txt is grep -n output, like 130:ADMIX
+      words = [ unidecode.unidecode(line).rpartition(':')[2] for line in f ]
+  except OSError as e:
+    raise RuntimeError(f'Could not read words from {filename}') from e
+  return Wordindex.fromwords(words,seed=seed)
+
+def runone(puzzle,wi,seed,max_nodes,timeout,restarts=None):
+  '''one fill, timed from building the Filler to the end of the search'''
+  started = time.perf_counter()
+  filler = Filler(puzzle,wi,nogoods=Nogoodcache(),seed=seed)
+  filled = filler.fill(timeout=timeout,max_nodes=max_nodes,restarts=restarts) is not None
+  return { 'seed': seed, 'filled': filled, 'nodes': filler.nodes,
+           'restarts': filler.restarts, 'seconds': time.perf_counter() - started }
+
+def runall(grids,dictionaries,seeds,max_nodes,timeout,restarts=None):
+  '''
+  every grid with every dictionary and every seed.  Returns a dict of
+  results, keyed by "grid/dictionary".
+  '''
+  puzzles = { name: loadgrid(name) for name in grids }
+  results = {}
+  for dictionary in dictionaries:
+    started = time.perf_counter()
+    wi = loadwords(dictionary,seeds[0])
+    print(f'{dictionary}: loaded in {time.perf_counter() - started:.2f}s', file=sys.stderr)
+    for grid in grids:
+      runs = [ runone(puzzles[grid],wi,seed,max_nodes,timeout,restarts) for seed in seeds ]
+      seconds = sum(run['seconds'] for run in runs)
+      nodes = sum(run['nodes'] for run in runs)
+      results[f'{grid}/{dictionary}'] = {
+        'runs': runs,
+        'success_rate': sum(run['filled'] for run in runs) / len(runs),
+        'seconds': seconds,
+        'nodes': nodes,
+        'nodes_per_second': nodes / seconds if seconds else 0.0,
+      }
+  return results
+
+def report(results):
+  print(f"{'grid/dictionary':36} {'filled':>7} {'seconds':>9} {'nodes':>9} {'nodes/s':>9}")
+  for key, r in results.items():
+    print(f"{key:36} {r['success_rate']:7.0%} {r['seconds']:9.3f} "
+          f"{r['nodes']:9d} {r['nodes_per_second']:9.0f}")
+
+def compare(results,baseline,tolerance):
+  '''
+  what got worse since the baseline: a lower success rate, or nodes per
+  second down by more than tolerance (a fraction), for runs that took
+  at least MIN_SECONDS.  Changed node
+  counts are reported too, since with fixed seeds they mean the search
+  itself behaves differently.  Returns the number of regressions.
+  '''
+  regressions = 0
+  for key, r in results.items():
+    if key not in baseline:
+      print(f'{key}: not in the baseline')
+      continue
+    b = baseline[key]
+    if r['success_rate'] < b['success_rate']:
+      print(f"REGRESSION {key}: filled {r['success_rate']:.0%}, was {b['success_rate']:.0%}")
+      regressions += 1
+    if (b['seconds'] >= MIN_SECONDS and
+        r['nodes_per_second'] < b['nodes_per_second'] * (1 - tolerance)):
+      print(f"REGRESSION {key}: {r['nodes_per_second']:.0f} nodes/s, was {b['nodes_per_second']:.0f}")
+      regressions += 1
+    if r['nodes'] != b['nodes']:
+      print(f"{key}: {r['nodes']} nodes, was {b['nodes']}")
+  return regressions
+
+def main(argv=None):
+  """run the benchmarks"""
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--grids', nargs='+', default=list(GRIDFILES) + list(SYNTHETIC),
+                      choices=list(GRIDFILES) + list(SYNTHETIC))
+  parser.add_argument('--dictionaries', nargs='+', default=list(DICTIONARIES),
+                      choices=list(DICTIONARIES))
+  parser.add_argument('--seeds', nargs='+', type=int, default=SEEDS)
+  parser.add_argument('--max-nodes', type=int, default=5000,
+                      help='give up on a fill after trying this many candidates')
+  parser.add_argument('--timeout', type=float,
+                      help='give up on a fill after this many seconds (makes results depend on the machine)')
+  parser.add_argument('--restarts', choices=['luby', 'geometric'],
+                      help='fill with restarts on this schedule, to compare with a baseline without')
+  parser.add_argument('--restart-base', type=int, default=100)
+  parser.add_argument('--reorder', action='store_true')
+  parser.add_argument('--baseline',
+                      help='compare with the results saved in this file, exiting 1 on a regression')
+  parser.add_argument('--tolerance', type=float, default=0.25,
+                      help='how much slower in nodes/s than the baseline counts as a regression')
+  parser.add_argument('--save', help='save the results to this file, to use as a baseline')
+  args = parser.parse_args(argv)
+
+  restarts = None
+  if args.restarts is not None:
+    restarts = Restarts(schedule=args.restarts,base=args.restart_base,reorder=args.reorder)
+  results = runall(args.grids,args.dictionaries,args.seeds,args.max_nodes,args.timeout,restarts)
+  report(results)
+
+  if args.save:
+    with open(args.save,'w',encoding='utf-8') as f:
+      json.dump(results,f,indent=2)
+  if args.baseline:
+    with open(args.baseline,encoding='utf-8') as f:
+      baseline = json.load(f)
+    if compare(results,baseline,args.tolerance):
+      return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+"""
+an iterative fill search for a Puzzlestate: an explicit stack of
+frames instead of one python call per item
+"""
+
+import logging
+import random
+import time
+import itertools
+from dataclasses import dataclass, field
+from typing import Iterator
+from puzzlestate import Puzzlestate
+from propagator import Propagator
+from wordindex import _bitarray
+
+def _checkerboard(row: int,col: int) -> int:
+  if row % 2:
+    return col % 2
+  else:
+    return (col+1) % 2
+
+def luby(i: int) -> int:
+  '''the i'th term, counting from 1, of the Luby sequence 1,1,2,1,1,2,4,1,...'''
+  while True:
+    k = i.bit_length()
+    if i == (1 << k) - 1:
+      return 1 << (k-1)
+    i -= (1 << (k-1)) - 1
+
+@dataclass
+class Restarts:
+  '''
+  When Filler.fill() should give up on an attempt and start over: the
+  n'th attempt gets base * luby(n) candidates with the luby schedule,
+  or base * factor**(n-1) with the geometric one.  Every new attempt
+  gets a new seed, which changes the order candidates are tried in,
+  and picks slots with some noise (see Propagator.jitter); with
+  reorder, it also shuffles the order that breaks ties between slots.
+  '''
+  schedule: str = 'luby'
+  base: int = 100
+  factor: float = 1.5
+  reorder: bool = False
+
+  def __post_init__(self):
+    if self.schedule not in ('luby', 'geometric'):
+      raise RuntimeError(f'restart schedule must be luby or geometric, not {self.schedule}')
+
+  def budgets(self):
+    n = 1
+    while True:
+      if self.schedule == 'luby':
+        yield self.base * luby(n)
+      else:
+        yield int(self.base * self.factor ** (n-1))
+      n += 1
+
+@dataclass
+class Fillframe:
+  '''
+  one level of the search: the slot being filled, the candidate words
+  for it not yet tried, in the order we try them, and the depths to
+  blame if none of them work out.  The words come from an iterator, so
+  only the ones actually tried need ranking.  learn says whether
+  running out of words means those depths leave no fill at all, which
+  isn't so once some of the words have gone elsewhere or a fill below
+  has been counted.
+  '''
+  slot: int
+  words: Iterator[int]
+  conflicts: set = field(default_factory=set)
+  placed: bool = False
+  learn: bool = True
+
+class Filler:
+  '''
+  Fills every item of a puzzle with words from a Wordindex, using the
+  Propagator for candidate domains, minimum-remaining-values slot
+  ordering and conflict-directed backjumping.  The search runs in a
+  loop over self.frames, so the number of items is not limited by the
+  python recursion limit.
+
+  run() can be given a stop flag (anything with an is_set() method,
+  like a multiprocessing.Event), which it checks every STOP_CHECK_NODES
+  candidates tried, giving up if it is set.
+
+  Given a Fillstats, a Filler counts what it does there.  The step by
+  step log of the search only gets written when logging is at INFO
+  level or below, since at one line per candidate it is slow.
+
+  A Filler keeps all of its search state to itself, so several can
+  run at once in threads or processes.  Its candidate orders come from
+  a random generator of its own, seeded with seed, or without one, from
+  the system, so a seed makes a Filler's search repeatable.  Without
+  word scores, each candidate's rating gets up to JITTER per letter of
+  random noise before ranking, so that different seeds try different
+  candidates first and really do search differently.
+
+  The puzzle can be a Puzzlestate or a Slotgeometry.  fill() is the
+  simplest way in: it returns the changelist of a fill, or None.
+  givens are letters the fill has to keep, as { (row, col): letter };
+  the search works around them, and slots they fill completely aren't
+  searched at all (see Propagator).  Changelists start with those.
+
+  With distinct, fills that differ only in cold cells, which are in
+  just one slot and so checked by no crossing word (the coldspots of
+  Puzzlestate.incomplete_items()), count as one.  Two candidates for a
+  slot with the same letters where it crosses other slots lead to the
+  same search below, so the search only ever tries the first of them,
+  which costs nothing to remember.
+  Besides run(), which finds one fill, count() counts all of them, and split(),
+  start() and donate() let several Fillers share one search: each
+  works on a prefix, a list of (slot, word number) placements, and
+  can hand part of its remaining work to the others as more prefixes.
+  '''
+  STOP_CHECK_NODES = 256
+  JITTER = 10
+
+  def __init__(self,puzzle,wordindex,items=None,sparse=None,nogoods=None,arcconsistency=True,
+               seed=None,stats=None,givens=None,distinct=False):
+    self.puzzle = puzzle
+    self.wi = wordindex
+    self.random = random.Random(seed)
+    if sparse is None:
+      sparse = puzzle.sparseness() < 0.6
+    self.sparse = sparse
+    if items is None:
+      items = Filler.itemorder(puzzle)
+    self.prop = Propagator(puzzle,wordindex,items=items,
+                           arcconsistency=arcconsistency,nogoods=nogoods,givens=givens)
+    self.frames = []
+    self.prefix = []
+    self.nodes = 0
+    self.stopped = False
+    self.stats = stats
+    self.distinct = distinct
+    self.checked = [ sorted({ native for other, native, foreign in crossings })
+                     for crossings in self.prop.crossings ]
+    self.trace = False
+    self.best = []          # the most (slot, word number) placements seen at once
+    self.bestnode = 0       # self.nodes when self.best was last improved on
+    self.stalled = False
+    self.restarts = 0
+
+  @staticmethod
+  def itemorder(puzzle,shuffle=False,rng=random):
+    '''
+    the search picks items dynamically by candidate count; this order,
+    most crossings first, only breaks ties that are left after that.
+    With shuffle, items with equal crossings come in random order, from
+    rng.
+    '''
+    items = puzzle.getitems()
+    if shuffle:
+      rng.shuffle(items)
+    byxings = lambda x: len(puzzle.getintersectors(x) or {})
+    items.sort(key=byxings,reverse=True)
+    return items
+
+  def _weights(self,slot):
+    '''
+    for each position in the slot, the per-letter weights used to
+    decide which candidates to try first
+    '''
+    item = self.prop.items[slot]
+    length = self.prop.lengths[slot]
+    list_of_dicts = list()
+
+    if self.sparse:
+      pattern = self.prop.pattern(slot)
+      intersection_locs = { native for other, native, foreign in self.prop.crossings[slot] }
+      for i in range(length):
+        if pattern[i] != '?':
+          list_of_dicts.append( [ 0 for a in range(26) ])
+        elif i in intersection_locs:
+          list_of_dicts.append(Puzzlestate.PREFER_COMMON_LETTERS)
+        else:
+          list_of_dicts.append(Puzzlestate.SINGLE_LETTER_FREQS)
+    else:
+      row,col = self.puzzle.answerlocation(item.itemnumber)
+      prefer_a_vowel = bool(_checkerboard(row,col))
+      for i in range(length):
+        if prefer_a_vowel:
+          list_of_dicts.append(Puzzlestate.I_LIKE_VOWELS)
+        else:
+          list_of_dicts.append(Puzzlestate.I_LIKE_CONSONANTS)
+        prefer_a_vowel = not prefer_a_vowel
+    return list_of_dicts
+
+  def _rankcandidates(self,slot) -> Iterator[int]:
+    '''
+    the slot's live candidates, best-looking first, as they get taken.
+    A scored word index numbers its words best first already, so then
+    only ties need shuffling.
+    '''
+    if self.stats is not None:
+      return self._rankcandidates_counted(slot)
+    length = self.prop.lengths[slot]
+    if self.wi.scored:
+      return self.wi.bestfirst(length, self.prop.domains[slot], self.random)
+    return self.wi.ranked(length, _bitarray(self.prop.domains[slot]), self._weights(slot),
+                          self.random, jitter=Filler.JITTER*length)
+
+  def _rankcandidates_counted(self,slot):
+    length = self.prop.lengths[slot]
+    started = time.perf_counter()
+    if self.wi.scored:
+      ranked = self.wi.bestfirst(length, self.prop.domains[slot], self.random)
+      looked = time.perf_counter()
+    else:
+      trywords = _bitarray(self.prop.domains[slot])
+      looked = time.perf_counter()
+      ranked = self.wi.ranked(length, trywords, self._weights(slot), self.random,
+                              jitter=Filler.JITTER*length)
+      self.stats.scored += len(trywords)
+    self.stats.lookup(looked - started)
+    self.stats.scoringtime += time.perf_counter() - looked
+    self.stats.expanded += 1
+    return ranked
+
+  def _distinctwords(self,slot,wordnos) -> Iterator[int]:
+    '''wordnos, less any with the same crossing letters as one before them'''
+    checked = self.checked[slot]
+    if len(checked) == self.prop.lengths[slot]:
+      yield from wordnos
+      return
+    words = self.wi.words[self.prop.lengths[slot]]
+    seen = set()
+    for wordno in wordnos:
+      word = words[wordno]
+      key = ''.join(word[position] for position in checked)
+      if key not in seen:
+        seen.add(key)
+        yield wordno
+
+  def _candidates(self,slot) -> Iterator[int]:
+    '''the candidates to try for slot, in order'''
+    if self.distinct:
+      return self._distinctwords(slot, self._rankcandidates(slot))
+    return self._rankcandidates(slot)
+
+  def _push(self,slot):
+    if self.trace:
+      logging.info("%03d Trying to solve %s", self.prop.depth()+1, self.prop.items[slot])
+    # whatever narrowed this slot's domain is to blame if none of the
+    # remaining words work out
+    self.frames.append(Fillframe(slot=slot,
+                                 words=self._candidates(slot),
+                                 conflicts=set(self.prop.conflictset(slot))))
+
+  def _backjump(self,conflicts):
+    '''
+    the top frame has run out of words.  Pop frames, undoing their
+    placements, until we reach the deepest one in conflicts, which gets
+    to try its next word.  Returns False if there is no such frame.
+    '''
+    learn = self.frames.pop().learn
+    while self.frames:
+      depth = self.prop.depth()
+      frame = self.frames[-1]
+      self.prop.undo()
+      frame.placed = False
+      if depth in conflicts:
+        frame.conflicts |= conflicts
+        frame.learn = frame.learn and learn
+        return True
+      # nothing we could put here would fix what went wrong up there
+      if self.trace:
+        logging.info("%03d ...jumping back over %s", depth, self.prop.items[frame.slot])
+      self.frames.pop()
+    return False
+
+  def _chronological(self,frame,depth):
+    '''
+    from now on, frame blames everything above it when it runs out of
+    words, so backjumping can't skip a level that has something left
+    to try.  Needed once we have counted a fill, or given words away,
+    and then running out of words doesn't make a nogood either.
+    '''
+    frame.conflicts.update(range(depth))
+    frame.learn = False
+
+  def reset(self):
+    '''take every placement back out'''
+    self.frames = []
+    while self.prop.marks:
+      self.prop.undo()
+    self.prefix = []
+
+  def start(self,prefix=()):
+    '''
+    get ready to search: make the domains arc-consistent and place the
+    words in prefix, a sequence of (slot, word number).  False if that
+    already leaves some slot with no words.
+    '''
+    self.reset()
+    self.stopped = False
+    self.stalled = False
+    self.trace = logging.getLogger().isEnabledFor(logging.INFO)
+    if (wipedout := self.prop.establish()) is not None:
+      logging.info("no words fit %s", self.prop.items[wipedout])
+      return False
+    for slot, wordno in prefix:
+      if self.prop.assign(slot,wordno) is not None:
+        return False
+    self.prefix = list(prefix)
+    return True
+
+  def search(self,checkpoint=None,onsolution=None,maxnodes=None,resume=False) -> bool:
+    '''
+    The search loop, starting from wherever start() left things.
+    Every STOP_CHECK_NODES candidates it calls checkpoint(self), which
+    returns True to give up; it also gives up once self.nodes reaches
+    maxnodes.  With no onsolution it stops at the first
+    complete fill; otherwise it calls onsolution() for every complete
+    fill and keeps going for as long as that returns True.  Returns
+    True if it stopped with a complete fill in place.  With resume, it
+    carries on from the complete fill it last stopped at, to the next.
+    '''
+    if self.stats is None:
+      return self._search(checkpoint,onsolution,maxnodes,resume)
+    started = time.perf_counter()
+    hits = self.prop.nogoods.hits if self.prop.nogoods is not None else 0
+    try:
+      return self._search(checkpoint,onsolution,maxnodes,resume)
+    finally:
+      self.stats.searchtime += time.perf_counter() - started
+      if self.prop.nogoods is not None:
+        self.stats.nogoodhits += self.prop.nogoods.hits - hits
+
+  def _resume(self):
+    '''
+    take back the last placement of a complete fill, so the search can
+    go on to the next one
+    '''
+    base = len(self.prefix)
+    for i, f in enumerate(self.frames):
+      self._chronological(f, base+i)
+    self.prop.undo()
+    self.frames[-1].placed = False
+
+  def _search(self,checkpoint,onsolution,maxnodes,resume=False):
+    if resume:
+      if not self.frames:
+        # the fill came from the prefix and the givens alone
+        return False
+      self._resume()
+    elif (slot := self.prop.nextslot()) is None:
+      return onsolution is None or not onsolution()
+    else:
+      self._push(slot)
+
+    while self.frames:
+      depth = self.prop.depth() + 1
+      frame = self.frames[-1]
+
+      if (wordno := next(frame.words, None)) is None:
+        # all the candidate words were failures, and the deepest
+        # placement in conflicts is where to try a different word
+        if self.trace:
+          logging.info('%03d ...used up all the possible words',depth)
+        if self.stats is not None:
+          self.stats.backtracks[depth] += 1
+        frame.conflicts.discard(depth)
+        if frame.learn and self.prop.nogoods is not None:
+          self.prop.remember(frame.conflicts)
+        if not self._backjump(frozenset(frame.conflicts)):
+          return False
+        continue
+
+      if maxnodes is not None and self.nodes >= maxnodes:
+        if self.trace:
+          logging.info("%03d ...out of nodes", depth)
+        frame.words = itertools.chain((wordno,), frame.words)
+        self.stopped = True
+        return False
+      self.nodes += 1
+      if (checkpoint is not None and not self.nodes % Filler.STOP_CHECK_NODES
+          and checkpoint(self)):
+        if self.trace:
+          logging.info("%03d ...told to stop", depth)
+        frame.words = itertools.chain((wordno,), frame.words)
+        self.stopped = True
+        return False
+      if self.stats is None:
+        wipedout = self.prop.assign(frame.slot,wordno)
+      else:
+        started = time.perf_counter()
+        wipedout = self.prop.assign(frame.slot,wordno)
+        self.stats.propagationtime += time.perf_counter() - started
+        self.stats.nodes += 1
+        self.stats.wipeouts += wipedout is not None
+      if wipedout is not None:
+        if self.trace:
+          logging.info("%03d ...%s for %s would leave %s with no words",
+                      depth, self.prop.word(frame.slot,wordno),
+                      self.prop.items[frame.slot], self.prop.items[wipedout])
+        frame.conflicts |= self.prop.conflictset(wipedout)
+        self.prop.undo()
+        continue
+
+      if self.trace:
+        logging.info("%03d ...let's try %s for %s", depth,
+                    self.prop.word(frame.slot,wordno), self.prop.items[frame.slot])
+      frame.placed = True
+      if len(self.prop.marks) > len(self.best):
+        self.best = [ (placed, self.prop.assigned[placed]) for placed, mark in self.prop.marks ]
+        self.bestnode = self.nodes
+      if (slot := self.prop.nextslot()) is None:
+        # we havin steak tonight
+        if onsolution is None or not onsolution():
+          return True
+        self._resume()
+        continue
+      self._push(slot)
+    return False
+
+  def run(self,stop=None,timeout=None,max_nodes=None,stall=None) -> bool:
+    '''
+    Search for a complete fill.  Returns True with every slot assigned
+    if there is one, else False.  Gives up when stop is set, after
+    timeout seconds, after trying max_nodes candidates, or after
+    stall candidates without placing more words at once than before
+    (which sets self.stalled).  self.stopped tells whether a False came
+    from giving up rather than from running out of words.
+    '''
+    if not self.start():
+      return False
+    checkpoint = None
+    if stop is not None or timeout is not None or stall is not None:
+      deadline = None if timeout is None else time.monotonic() + timeout
+      def checkpoint(filler):
+        if stall is not None and filler.nodes - filler.bestnode >= stall:
+          filler.stalled = True
+          return True
+        return ((stop is not None and stop.is_set()) or
+                (deadline is not None and time.monotonic() >= deadline))
+    maxnodes = None if max_nodes is None else self.nodes + max_nodes
+    return self.search(checkpoint=checkpoint,maxnodes=maxnodes)
+
+  def fill(self,timeout=None,max_nodes=None,stop=None,stall=None,restarts=None):
+    '''
+    run(), returning the changelist of the fill, or None if there
+    isn't one or the search gave up first.  Either way,
+    bestchangelist() has the fill with the most words placed.
+
+    With stall, a search that goes stall candidates without placing
+    more words than before starts over with a new seed and with some
+    noise in which slot it fills next (see Propagator), and with
+    restarts (a Restarts), each attempt gets only as many candidates
+    as its schedule says.  Restarts keep the nogoods learned so far,
+    and go on for as long as the timeout and max_nodes allow.
+    self.restarts counts how many there were.
+    '''
+    deadline = None if timeout is None else time.monotonic() + timeout
+    lastnode = None if max_nodes is None else self.nodes + max_nodes
+    budgets = None if restarts is None else restarts.budgets()
+    self.best = []
+    self.bestnode = self.nodes
+    self.restarts = 0
+    self.prop.jitter = None
+    while True:
+      remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+      nodesleft = None if lastnode is None else lastnode - self.nodes
+      attemptnodes = nodesleft
+      if budgets is not None:
+        attemptnodes = next(budgets)
+        if nodesleft is not None:
+          attemptnodes = min(attemptnodes, nodesleft)
+      if self.run(stop=stop,timeout=remaining,max_nodes=attemptnodes,stall=stall):
+        return self.changelist()
+      if (not self.stopped or
+          (stop is not None and stop.is_set()) or
+          (deadline is not None and time.monotonic() >= deadline) or
+          (lastnode is not None and self.nodes >= lastnode)):
+        # either there is no fill, or we're out of time or nodes
+        return None
+      logging.info("giving up after %d candidates, starting over", self.nodes)
+      self.random = random.Random(self.random.getrandbits(32))
+      self.prop.jitter = self.random
+      if restarts is not None and restarts.reorder:
+        self.random.shuffle(self.prop.order)
+      self.bestnode = self.nodes
+      self.restarts += 1
+      if self.stats is not None:
+        self.stats.restarts += 1
+
+  def bestchangelist(self):
+    '''
+    like changelist(), but for the fill with the most words placed that
+    the last fill() got to, for when it didn't finish
+    '''
+    placed = [ (slot, self.prop.word(slot,wordno)) for slot, wordno in self.best ]
+    return [ (self.prop.items[slot], word, depth)
+             for depth, (slot, word) in enumerate(self._given() + placed) ]
+
+  def _given(self):
+    '''(slot, word) for the slots whose words are given'''
+    return sorted(self.prop.fixed.items())
+
+  def count(self,prefix=(),checkpoint=None) -> int:
+    '''
+    the number of complete fills, all of them, that extend prefix
+    '''
+    found = 0
+    def _onsolution():
+      nonlocal found
+      found += 1
+      return True
+    if self.start(prefix):
+      self.search(checkpoint=checkpoint,onsolution=_onsolution)
+    return found
+
+  def fills(self,prefix=(),limit=None,checkpoint=None):
+    '''
+    Every complete fill that extends prefix, as a changelist, one at a
+    time as the search finds them, up to limit of them
+    '''
+    if (limit is not None and limit <= 0) or not self.start(prefix):
+      return
+    found = 0
+    resume = False
+    while self.search(checkpoint=checkpoint,resume=resume):
+      yield self.changelist()
+      found += 1
+      if limit is not None and found >= limit:
+        return
+      resume = True
+
+  def estimate(self,samples,prefix=()) -> float:
+    '''
+    How many complete fills extend prefix, estimated from samples
+    random dives down the search tree (Knuth's estimator): each dive
+    multiplies together the number of candidates at every level, and
+    counts 0 if it ends in a dead end.  The average is an unbiased
+    estimate, though it takes more samples the more lopsided the tree.
+    '''
+    if not self.start(prefix):
+      return 0.0
+    base = len(self.prop.marks)
+    total = 0
+    for sample in range(samples):
+      weight = 1
+      while (slot := self.prop.nextslot()) is not None:
+        candidates = self.prop.candidates(slot)
+        if self.distinct:
+          candidates = list(self._distinctwords(slot, candidates))
+        weight *= len(candidates)
+        if self.prop.assign(slot,self.random.choice(candidates)) is not None:
+          weight = 0
+          break
+      total += weight
+      while len(self.prop.marks) > base:
+        self.prop.undo()
+    self.reset()
+    return total / samples if samples else 0.0
+
+  def split(self,mintasks,maxdepth=2):
+    '''
+    Prefixes that between them cover the whole search: the candidates
+    for the first slot, and if there are fewer than mintasks of those,
+    each extended by the candidates for the slot after it, and so on
+    down to maxdepth levels.  Dead ends get dropped along the way.
+    '''
+    level = [ [] ]
+    for depth in range(maxdepth):
+      if len(level) >= mintasks:
+        break
+      nextlevel = []
+      for prefix in level:
+        if not self.start(prefix):
+          continue
+        if (slot := self.prop.nextslot()) is None:
+          nextlevel.append(prefix)
+          continue
+        for wordno in self._candidates(slot):
+          if self.prop.assign(slot,wordno) is None:
+            nextlevel.append(prefix + [ (slot, wordno) ])
+          self.prop.undo()
+      level = nextlevel
+    self.reset()
+    return level
+
+  def donate(self):
+    '''
+    Give away half of the untried words of the shallowest frame that
+    has any, as prefixes another Filler can start() from.  Returns []
+    if there is nothing to give.
+    '''
+    base = len(self.prefix)
+    for i, frame in enumerate(self.frames):
+      untried = list(frame.words)
+      if not untried:
+        continue
+      give = untried[len(untried)//2:]
+      frame.words = iter(untried[:len(untried)-len(give)])
+      # this frame can't see why the donated words fail, so it must
+      # not jump past anything when it runs out
+      self._chronological(frame, base+i)
+      above = self.prefix + [ (f.slot, self.prop.assigned[f.slot]) for f in self.frames[:i] ]
+      return [ above + [ (frame.slot, wordno) ] for wordno in give ]
+    return []
+
+  def changelist(self):
+    '''
+    the placements so far as (item, word, depth) tuples, which is what
+    Puzzlestate.populate_solution_from_changelist() wants
+    '''
+    placed = [ slot for slot, wordno in self.prefix ]
+    placed += [ frame.slot for frame in self.frames if frame.placed ]
+    placed = [ (slot, self.prop.word(slot,self.prop.assigned[slot])) for slot in placed ]
+    return [ (self.prop.items[slot], word, depth)
+             for depth, (slot, word) in enumerate(self._given() + placed) ]
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+the letters placed so far during a fill search, kept in a form that
+is cheap to update and to back out
+"""
+
+from puzzlestate import Puzzlegeometry
+
+class Fillgrid:
+  '''
+  The grid is a flat bytearray with one byte per cell, row by row, and
+  EMPTY in cells no placed word covers yet.  Every cell also has a
+  reference count of the placed words covering it, so removing a word
+  only clears the cells no other placed word still needs.
+
+  Each slot's cells are an (extended) slice of the bytearray, so the
+  pattern for a slot, like ?A??E, is a single slice.
+  '''
+  EMPTY = ord('?')
+
+  def __init__(self,puzzle,items,lengths):
+    self.width = puzzle.width()
+    self.height = puzzle.height()
+    self.cells = bytearray([ Fillgrid.EMPTY ]) * (self.width * self.height)
+    self.refs = bytearray(self.width * self.height)
+
+    self.slices = []
+    for item, length in zip(items,lengths):
+      row,col = puzzle.answerlocation(item.itemnumber)
+      rowinc, colinc = Puzzlegeometry.directions[item.direction]
+      start = row * self.width + col
+      step = rowinc * self.width + colinc
+      self.slices.append(slice(start, start + step*(length-1) + 1, step))
+
+  def cellnumbers(self,slot):
+    return range(self.slices[slot].start, self.slices[slot].stop, self.slices[slot].step)
+
+  def pattern(self,slot) -> str:
+    return self.cells[self.slices[slot]].decode('ascii')
+
+  def place(self,slot,word):
+    for cell, c in zip(self.cellnumbers(slot), word.encode('ascii')):
+      if not self.refs[cell]:
+        self.cells[cell] = c
+      self.refs[cell] += 1
+
+  def give(self,cell,letter):
+    '''put a letter in a cell for good: no remove() takes it out again'''
+    self.cells[cell] = ord(letter)
+    self.refs[cell] += 1
+
+  def remove(self,slot):
+    for cell in self.cellnumbers(slot):
+      self.refs[cell] -= 1
+      if not self.refs[cell]:
+        self.cells[cell] = Fillgrid.EMPTY
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+counters for finding out where a fill search spends its time
+"""
+
+import json
+from collections import Counter
+
+class Fillstats:
+  '''
+  What one or more fill searches did, counted by a Filler given one of
+  these.  Fillers without one skip the counting altogether, so it costs
+  nothing unless asked for.
+
+  A lookup is getting a slot's live candidates out of its domain, and
+  scoring is rating and ordering them; their latencies go into a
+  histogram with power-of-two microsecond buckets.  Propagation is
+  what happens when a candidate gets placed.
+  '''
+
+  def __init__(self):
+    self.expanded = 0           # slots whose candidates got looked up
+    self.nodes = 0              # candidate words tried
+    self.wipeouts = 0           # of those, how many left some slot with no words
+    self.backtracks = Counter() # depth -> times the slot there ran out of words
+    self.lookups = 0
+    self.scored = 0             # candidates rated
+    self.latency = Counter()    # bucket -> lookups taking less than 2**bucket us
+    self.lookuptime = 0.0
+    self.scoringtime = 0.0
+    self.propagationtime = 0.0
+    self.searchtime = 0.0
+    self.nogoodhits = 0
+    self.restarts = 0
+
+  def lookup(self,seconds):
+    self.lookups += 1
+    self.lookuptime += seconds
+    self.latency[int(seconds * 1e6).bit_length()] += 1
+
+  def asdict(self):
+    return {
+      'expanded': self.expanded,
+      'nodes': self.nodes,
+      'nodes_per_second': self.nodes / self.searchtime if self.searchtime else 0.0,
+      'wipeouts': self.wipeouts,
+      'backtracks_by_depth': { depth: self.backtracks[depth] for depth in sorted(self.backtracks) },
+      'lookups': self.lookups,
+      'lookup_latency_us': { f'<{2**bucket}': self.latency[bucket]
+                             for bucket in sorted(self.latency) },
+      'candidates_scored': self.scored,
+      'nogood_hits': self.nogoodhits,
+      'restarts': self.restarts,
+      'seconds': {
+        'search': self.searchtime,
+        'lookup': self.lookuptime,
+        'scoring': self.scoringtime,
+        'propagation': self.propagationtime,
+      },
+    }
+
+  def json(self):
+    return json.dumps(self.asdict(), indent=2)
+
+  def summary(self) -> str:
+    d = self.asdict()
+    seconds = d['seconds']
+    lines = [
+      f"{d['nodes']} candidates tried in {seconds['search']:.3f}s "
+      f"({d['nodes_per_second']:.0f}/s), {d['wipeouts']} wiped out a crossing slot",
+      f"{d['expanded']} slots expanded, {d['candidates_scored']} candidates scored, "
+      f"{d['nogood_hits']} nogood hits, {d['restarts']} restarts",
+      f"lookup {seconds['lookup']:.3f}s, scoring {seconds['scoring']:.3f}s, "
+      f"propagation {seconds['propagation']:.3f}s",
+      f"{d['lookups']} lookups, latency histogram (us): " +
+      ', '.join(f'{bucket}: {n}' for bucket, n in d['lookup_latency_us'].items()),
+      "backtracks by depth: " +
+      ', '.join(f'{depth}: {n}' for depth, n in d['backtracks_by_depth'].items()),
+    ]
+    return '\n'.join(lines)
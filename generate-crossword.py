@@ -4,199 +4,273 @@
 gc2.py: fill a crossword puzzle bracket with random words
 
 usage: gc2.py puzzlefile.json
+
+All the filling happens in Filler (filler.py), parallelfill.py and
+batchfill.py; this is just the command line in front of them.
 """
 
+import re
+import json
 import logging
-import os.path
 import argparse
 from os import getpid
-from wordfountain import Wordfountain
-from puzzlestate import Puzzlestate
-
-SUCCESS = -1
-TRY_A_DIFFERENT_WORD = 0
-# a recursive return value of N>0 means that we need to backtrack N times
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-o', '--output')
-parser.add_argument('-f', '--force', action='store_true')
-parser.add_argument('-d', '--db')
-parser.add_argument('infile',type=argparse.FileType('r', encoding='latin-1'))
-
-args = parser.parse_args()
-infilename = args.infile.name
-outfilename = args.output
-worddb = args.db
-
-assert infilename is not None
+from nogoods import Nogoodcache
+from filler import Filler, Restarts
+from parallelfill import loadwords, racefill, treefill
+from batchfill import batchinputs, batchfill, outputname
+from puzzlestate import Puzzlestate, Puzzleitem
+from slotgeometry import Slotgeometry
+from wordindex import Wordindex
+from fillstats import Fillstats
+
+def parseentry(entry):
+  '''1A=GARDEN, or 17 down=PATHS, as (Puzzleitem, word)'''
+  match = re.fullmatch(r'\s*(\d+)\s*([ad])[a-z]*\s*=\s*([a-z]+)\s*', entry, re.IGNORECASE)
+  if match is None:
+    raise RuntimeError(f'expected a seed entry like 1A=WORD, not {entry}')
+  number, direction, word = match.groups()
+  return (Puzzleitem(itemnumber=int(number),
+                     direction='Across' if direction.upper() == 'A' else 'Down'),
+          word.upper())
+
+def givenletters(puzzle,entries,keepletters=False):
+  '''
+  The letters a fill of puzzle has to keep, as { (row, col): letter }:
+  those of entries, a list of (item, word), and with keepletters, those
+  already in the puzzle's solution.  Raises RuntimeError if an entry
+  doesn't fit its slot, or clashes with those letters or another entry.
+  '''
+  scratch = puzzle.copy()
+  if not keepletters:
+    scratch.clearletters()
+  items = set(scratch.getitems())
+  for item, word in entries:
+    if item not in items:
+      raise RuntimeError(f'there is no {item} to put {word} in')
+    if len(word) != scratch.getlength(item):
+      raise RuntimeError(f'{word} is the wrong length for {item}, which has {scratch.getlength(item)} letters')
+    if not scratch.test_word(word,item.direction,item.itemnumber):
+      raise RuntimeError(f'{word} in {item} clashes with a letter already there')
+    scratch.inscribe_word_in_solution(item,word)
+  return scratch.givenletters()
+
+def parseargs(argv=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-o', '--output')
+  parser.add_argument('-f', '--force', action='store_true')
+  parser.add_argument('-d', '--db')
+  parser.add_argument('-w', '--wordlist',
+                      help='build an in-memory word index from this word list instead of using a db')
+  parser.add_argument('--min-score', type=int,
+                      help='leave out words scoring less than this, in word lists or dbs with scores')
+  parser.add_argument('--layer', action='append', default=[], metavar='WORDS[:PRIORITY]',
+                      help='add the words in this list, db or index to the others, tried before '
+                           'words with a lower priority (default 1; the -w or -d words have 0)')
+  parser.add_argument('--block', action='append', default=[], metavar='WORDS',
+                      help='never use the words in this list, db or index')
+  parser.add_argument('-s', '--seed', type=int, default=0,
+                      help='random seed, 0 to seed from the clock')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='race this many worker processes with different seeds, or with --batch, fill this many puzzles at once')
+  parser.add_argument('--tree', action='store_true',
+                      help='with --jobs, share one search tree among the workers instead of racing seeds')
+  parser.add_argument('--count', action='store_true',
+                      help='count every possible fill instead of saving one')
+  parser.add_argument('--fills', metavar='OUT.jsonl',
+                      help='write every possible fill to OUT.jsonl, one json object a line, instead of saving one')
+  parser.add_argument('--limit', type=int,
+                      help='with --fills, stop after this many')
+  parser.add_argument('--estimate', type=int, metavar='SAMPLES',
+                      help='estimate how many possible fills there are from this many random samples, for when --count would take too long')
+  parser.add_argument('--distinct', action='store_true',
+                      help='with --count, --fills or --estimate, take fills that differ only in unchecked cells as one')
+  parser.add_argument('--nogoods', type=int, default=100000,
+                      help='how many dead combinations of words to remember (0 to turn off)')
+  parser.add_argument('--geometry-cache', metavar='DIR',
+                      help='keep compiled grid geometries in DIR, and reuse them for grids with the same barriers')
+  parser.add_argument('--batch', metavar='OUTDIR',
+                      help='infile is a directory of puzzles, or a file listing them; fill them all into OUTDIR')
+  parser.add_argument('--stats', action='store_const', const='text',
+                      help='count what the search does and print a summary')
+  parser.add_argument('--stats-json', dest='stats', action='store_const', const='json',
+                      help='like --stats, but print json')
+  parser.add_argument('--trace', action='store_true',
+                      help='log every step of the search to /tmp/gc2-<pid>.log, which is slow')
+  parser.add_argument('--timeout', type=float,
+                      help='give up after this many seconds, saving the best partial fill')
+  parser.add_argument('--max-nodes', type=int,
+                      help='give up after trying this many candidates, saving the best partial fill')
+  parser.add_argument('--seed-entries', action='append', default=[], metavar='ITEM=WORD,...',
+                      help='put these words in these slots first, like 1A=GARDEN,17D=PATHS, and fill in around them')
+  parser.add_argument('--keep-letters', action='store_true',
+                      help='keep the letters already in the puzzle\'s solution, and fill in around them')
+  parser.add_argument('--restart-on-stall', type=int, metavar='NODES',
+                      help='start over with a new seed after this many candidates without progress')
+  parser.add_argument('--restarts', choices=['luby', 'geometric'],
+                      help='start over with a new seed on this schedule of node budgets')
+  parser.add_argument('--restart-base', type=int, default=100, metavar='NODES',
+                      help='the node budget the --restarts schedule is in multiples of')
+  parser.add_argument('--reorder', action='store_true',
+                      help='with --restarts, also shuffle how ties between slots are broken')
+  parser.add_argument('infile')
+  args = parser.parse_args(argv)
+  args.layers = []
+  for layer in args.layer:
+    filename, colon, priority = layer.rpartition(':')
+    if colon and priority.lstrip('-').isdigit():
+      args.layers.append( (filename, int(priority)) )
+    else:
+      args.layers.append( (layer, 1) )
+  try:
+    args.entries = [ parseentry(entry) for entries in args.seed_entries
+                     for entry in entries.split(',') if entry.strip() ]
+  except RuntimeError as e:
+    parser.error(str(e))
+  if args.entries and args.batch is not None:
+    parser.error('--seed-entries needs a single puzzle, not --batch')
+  if (args.fills or args.estimate) and (args.jobs > 1 or args.batch is not None):
+    parser.error('--fills and --estimate need a single process and a single puzzle')
+  if args.limit is not None and not args.fills:
+    parser.error('--limit goes with --fills')
+  args.restartpolicy = None
+  if args.restarts is not None:
+    args.restartpolicy = Restarts(schedule=args.restarts,base=args.restart_base,
+                                  reorder=args.reorder)
+  if args.jobs > 1 and args.batch is None:
+    if args.stats:
+      parser.error('--stats needs a single process, or --batch')
+    if args.timeout or args.max_nodes or args.restart_on_stall or args.restarts:
+      parser.error('--timeout, --max-nodes, --restart-on-stall and --restarts need a single process, or --batch')
+  if args.output is None:
+    args.output = outputname(args.infile)
+  # for the mistakes that only show up once the puzzle is read
+  args.error = parser.error
+  return args
+
+def main(argv=None):
 
-if outfilename is None:
-  if infilename.rfind('.ipuz') == -1:
-    outfilename = infilename + '-out.ipuz'
-  else:
-    outfilename = (infilename[::-1].replace('zupi.','zupi.tuo-',1))[::-1]
+  """fill a crossword puzzle bracket with random words"""
 
-def _checkerboard(row: int,col: int) -> int:
-  if row % 2:
-    return col % 2
+  args = parseargs(argv)
+  infilename = args.infile
+  worddb = args.db
+  wordlist = args.wordlist
+
+  if args.trace:
+    logging.basicConfig(filename=f'/tmp/gc2-{getpid()}.log',
+                      level=logging.INFO)
+
+  if args.batch is not None:
+    # one word index, loaded here, for every puzzle in the batch
+    records = batchfill(batchinputs(infilename),args.batch,
+                        loadwords(worddb=worddb,wordlist=wordlist,seed=args.seed,
+                                  minscore=args.min_score,layers=args.layers,
+                                  blocklists=args.block),
+                        jobs=args.jobs,seed=args.seed,nogoodsize=args.nogoods,
+                        geometrycache=args.geometry_cache,stats=args.stats is not None,
+                        timeout=args.timeout,max_nodes=args.max_nodes,
+                        stall=args.restart_on_stall,restarts=args.restartpolicy,
+                        keepletters=args.keep_letters)
+    for record in records:
+      outcome = record.get('outfile', record.get('error', 'could not fill'))
+      if 'partial' in record:
+        outcome = f"{record['partial']} of {record['slots']} slots filled, in {outcome}"
+      print(f"{record['infile']}: {outcome} ({record['seconds']:.2f}s)")
+    return
+
+  # the search only needs the shape of the grid; the puzzle itself is
+  # for writing out the answer, so with a cached geometry it only gets
+  # parsed if it is needed
+  data = Puzzlestate.readjson(infilename)
+  puzzle = None
+  if args.geometry_cache is not None:
+    geometry = Slotgeometry.fromjson(data,infilename,cachedir=args.geometry_cache)
   else:
-    return (col+1) % 2
-
-# class puzzlesolution:
-#   def __init__(self, itemlist):
-#     self.itemlist = itemlist 
-#    self.solution_trail = []
-#   def shuffle_the_future:
-#     where_to_start = len(self.solution_trail)
-#     end_of_list = len(self.itemlist)-1
-#     for i in reversed(xrange(where_to_start+1, end_of_list)):
-#       j = random.randint(startIdx, i)
-#       x[i], x[j] = x[j], x[i]
-
-paths_already_explored: set[list] = set()
-
-def completeboard(sofar,recursiondepth,sparse=False) -> int:
-  global puzzle
-  global items
-  global paths_already_explored
-
-  if recursiondepth == len(items):
-    return SUCCESS # we havin steak tonight
-
-  # OK! If we are N recursions in, that means we are going to try to
-  # find a word to fill in the N'th item in items.
-  target_item = items[recursiondepth]
-  row,col = puzzle.answerlocation(target_item.itemnumber)
-
-  logging.info("%03d Trying to solve %s", recursiondepth, target_item)
-
-  # Let's iterate through how we got here, looking for words already
-  # inscribed that create a constraint for us.
-  constraints = list()
-  intersectors = puzzle.getintersectors(target_item)
-  latest_intersector_depth = recursiondepth
-  if intersectors is not None:
-    for histentry in sofar:  
-      # a histentry looks like ("5 Across","MAPLE",6)
-      # where the 6 means that this word got proposed as part of the solution 6 steps deep
-      i,w,d = histentry
-      if i in intersectors:
-        # uh oh, we might have to extract a constraint
-        native_charcount, foreign_charcount = intersectors[i]
-        if isinstance(w[foreign_charcount],str):
-          assert w[foreign_charcount] != Puzzlestate.BARRIER
-          if w[foreign_charcount] != Puzzlestate.UNSET:
-            constraints.append( ( native_charcount, w[foreign_charcount]) )
-            latest_intersector_depth = d
-
-  # {1 Down: (0, 1), 2 Down: (1, 1), 3 Down: (2, 1), 4 Down: (3, 1), 5 Down: (4, 1)}
-  intersection_locs = None
-  if intersectors is not None:
-    intersection_locs = [ intersectors[k][0] for k in intersectors ]
-  intersection_locs = set(intersection_locs)
-
-  # constraints values look like this:
-  # [(0, 'R'), (1, 'S'), (2, 'R'), (3, 'R'), (4, 'S')]
-  constraint_locs = []
-  if len(constraints):
-    constraint_locs: list[int] = [ i[0] for i in constraints ]
-    constraint_locs = list(set(constraint_locs)).sort()
-
-  list_of_dicts = list()
-
-  if sparse:
-    for i in range(puzzle.answerlength(target_item)):
-      if constraint_locs and i in constraint_locs:
-        list_of_dicts.append( [ 0 for a in range(26) ])
-      elif intersection_locs and i in intersection_locs:
-        list_of_dicts.append(Puzzlestate.PREFER_COMMON_LETTERS)
-      else:
-        list_of_dicts.append(Puzzlestate.SINGLE_LETTER_FREQS)
+    puzzle = geometry = Puzzlestate.fromjson(data,infilename)
+  givens = None
+  if args.entries or args.keep_letters:
+    if puzzle is None:
+      puzzle = Puzzlestate.fromjson(data,infilename)
+    try:
+      givens = givenletters(puzzle,args.entries,keepletters=args.keep_letters)
+    except RuntimeError as e:
+      args.error(str(e))
+
+  if args.jobs > 1 and (args.tree or args.count):
+    # the workers split up the search tree
+    count, sofar = treefill(geometry,args.jobs,worddb=worddb,wordlist=wordlist,
+                            seed=args.seed,nogoodsize=args.nogoods,
+                            countall=args.count,minscore=args.min_score,
+                            layers=args.layers,blocklists=args.block,givens=givens,
+                            distinct=args.distinct)
+  elif args.jobs > 1:
+    # every worker loads its own words and puzzle
+    sofar = racefill(infilename,args.jobs,worddb=worddb,wordlist=wordlist,
+                     seed=args.seed,nogoodsize=args.nogoods,
+                     geometrycache=args.geometry_cache,minscore=args.min_score,
+                     layers=args.layers,blocklists=args.block,givens=givens)
   else:
-    if _checkerboard(row,col):
-      prefer_a_vowel = True
+    # the search keeps a bitset domain for every item, so it needs the
+    # word list in memory, even when it comes from a db
+    wi = loadwords(worddb=worddb,wordlist=wordlist,seed=args.seed,minscore=args.min_score,
+                   layers=args.layers,blocklists=args.block)
+    nogoods = None
+    if args.nogoods > 0:
+      nogoods = Nogoodcache(maxsize=args.nogoods)
+    stats = Fillstats() if args.stats else None
+    filler = Filler(geometry,wi,nogoods=nogoods,seed=args.seed or Wordindex.clockseed(),
+                    stats=stats,givens=givens,distinct=args.distinct)
+    if args.count:
+      count = filler.count()
+    elif args.estimate:
+      estimate = filler.estimate(args.estimate)
+    elif args.fills:
+      # one line at a time, so that memory stays flat however many there are
+      count = 0
+      with open(args.fills,'w',encoding='utf-8') as f:
+        for changelist in filler.fills(limit=args.limit):
+          entries = { str(item): word for item, word, depth in sorted(changelist) }
+          f.write(json.dumps({ 'fill': count, 'entries': entries }) + '\n')
+          count += 1
     else:
-      prefer_a_vowel = False
-    for i in range(puzzle.answerlength(target_item)):
-      if prefer_a_vowel:
-        list_of_dicts.append(Puzzlestate.I_LIKE_VOWELS)
-      else:
-        list_of_dicts.append(Puzzlestate.I_LIKE_CONSONANTS)
-      prefer_a_vowel = not prefer_a_vowel
-
-  assert len(list_of_dicts) == puzzle.answerlength(target_item), \
-     "yer logic is faulty"
-  def _ratewordcandidate_lambda(vec):
-    def _rater(w):
-      score = 0
-      for i,c in enumerate(w):
-        score += vec[i][ord(c)-ord('A')]
-      return score
-    return _rater
-
-  _ratewordcandidate = _ratewordcandidate_lambda(list_of_dicts)
-
-  trywords = wf.matchingwords(puzzle.getlength(target_item), constraints)
-  if len(trywords) == 0:
-    logging.info("%03d ...no words match, thanks to a word inserted at depth %d",
-                recursiondepth, latest_intersector_depth)
-    return recursiondepth - latest_intersector_depth
-
-  trywords.sort(key=_ratewordcandidate,reverse=True)
-  for trythis in trywords:
-    logging.info("%03d ...let's try %s for %s", 
-                recursiondepth, trythis, target_item)
-    sofar.append( (target_item,trythis, recursiondepth) )
-    if (retval := completeboard(sofar,recursiondepth+1)) == SUCCESS:
-      return SUCCESS # yay!
-    elif retval > 0:
-      logging.info("%03d ...just got a retval of %d",
-                  recursiondepth, retval)
-      sofar.pop()
-      return retval-1
-    sofar.pop()
-    # and around the loop we go
-
-  # if we make it here, that means all the candidate words were failures
-  # so we have to choose a different word and try again
-  logging.info('%03d ...used up all the possible words, going to reshuffle',recursiondepth)
-  if recursiondepth + 1 == length(items):
-    logging.info('%03d ...nothing to reshuffle, ugh',recursiondepth)
-    raise RuntimeError('dang')
-  items[recursiondepth], items[recursiondepth+1] = items[recursiondepth+1], items[recursiondepth] 
-  return NO_WORDS_MATCH
-
-puzzle = dict()
-items = list()
-wf = lambda x: x
-
-def main():
-
-  """fill a crossword puzzle bracket with random words"""
-
-  global puzzle
-  global items
-  global wf
-
-  wf = Wordfountain(worddb=worddb,seed=0)
-  logging.basicConfig(filename=f'/tmp/gc2-{getpid()}.log',
-                    level=logging.INFO)
-
-  puzzle = Puzzlestate.fromjsonfile(infilename)
-
-  sparseness = puzzle.sparseness()
-  sofar = list()
-  items = list(puzzle.data['items_expanded'])
-  bylen = lambda x: puzzle.data['items_expanded'][x]['wordlength']
-  byxings = lambda x: len(puzzle.data['items_expanded'][x]['intersectors'])
-  items.sort(key=byxings,reverse=True)
-
-  if completeboard(sofar,0,sparse=(sparseness < 0.6)) == SUCCESS:
+      sofar = filler.fill(timeout=args.timeout,max_nodes=args.max_nodes,
+                          stall=args.restart_on_stall,restarts=args.restartpolicy)
+    if args.stats == 'json':
+      print(stats.json())
+    elif args.stats:
+      print(stats.summary())
+
+  if args.count:
+    print(f'{infilename} has {count} possible fills')
+    return
+  if args.estimate:
+    print(f'{infilename} has about {estimate:.4g} possible fills ({args.estimate} samples)')
+    return
+  if args.fills:
+    print(f'wrote {count} fills of {infilename} to {args.fills}')
+    return
+
+  if puzzle is None and (sofar is not None or (args.jobs == 1 and filler.best)):
+    puzzle = Puzzlestate.fromjson(data,infilename)
+  if sofar is not None:
     puzzle.populate_solution_from_changelist(sofar)
-    puzzle.writejson(outfilename)
+    puzzle.writejson(args.output)
     print('Just saved to json')
     puzzle.print_solution()
     puzzle.writesvg('solution.svg',showtitle=True,showcluenumbers=True,showsolvedcells=True)
+  elif args.jobs == 1 and filler.best:
+    # give a human something to finish off
+    partial = filler.bestchangelist()
+    # whatever the puzzle had in the slots the search never got to
+    # would look like part of the fill
+    puzzle.clearletters().setletters(givens or {})
+    puzzle.populate_solution_from_changelist(partial)
+    puzzle.writejson(args.output)
+    print(f'could not fill {infilename}, but saved {len(partial)} of '
+          f'{len(filler.prop.items)} slots filled to {args.output}')
+    puzzle.print_solution()
+  else:
+    print(f'could not fill {infilename}')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+compiled files, like word indexes and grid geometries, that get
+written once and then mmapped by every process that wants them
+"""
+
+import os
+import mmap
+
+def writeatomic(filename,data: bytes):
+  '''
+  write data to filename under a temporary name first, and then rename
+  it, so nobody can mmap half a file
+  '''
+  tmpfile = f'{filename}.{os.getpid()}'
+  try:
+    with open(tmpfile, 'wb') as f:
+      f.write(data)
+    os.replace(tmpfile, filename)
+  except BaseException:
+    if os.path.exists(tmpfile):
+      os.remove(tmpfile)
+    raise
+
+def openmapped(filename) -> mmap.mmap:
+  '''
+  filename, mmapped read-only.  Memoryviews into it can't be pickled,
+  so whatever gets built on one has to pickle as something else, like
+  the filename, for another process to map again.
+  '''
+  with open(filename, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+a bounded store of nogoods found during the fill search
+"""
+
+from collections import OrderedDict
+
+class Nogoodcache:
+  '''
+  Remembers nogoods: sets of placements, each a (slot, word number)
+  pair, that the search has found to leave no complete fill between
+  them, whatever else goes in the grid.  violated() tells the search
+  when a placement would complete one of them again, so it can turn
+  that placement away without searching below it.  When the cache is
+  full, the least recently used nogood goes.
+
+  Slots and word numbers are those of one Propagator, so a cache
+  should only be shared by searches of the same puzzle with the same
+  Wordindex and givens.
+  '''
+
+  def __init__(self,maxsize=100000):
+    assert isinstance(maxsize,int) and maxsize > 0, \
+      "nogood cache size must be a positive integer"
+    self.maxsize = maxsize
+    self.entries = OrderedDict()
+    self.watches = {}     # placement -> the nogoods it is in
+    self.hits = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self,nogood):
+    return nogood in self.entries
+
+  def add(self,nogood):
+    '''nogood is a frozenset of (slot, word number) placements'''
+    if nogood in self.entries:
+      self.entries.move_to_end(nogood)
+      return
+    self.entries[nogood] = None
+    for placement in nogood:
+      self.watches.setdefault(placement,set()).add(nogood)
+    if len(self.entries) > self.maxsize:
+      old, _ = self.entries.popitem(last=False)
+      for placement in old:
+        watching = self.watches[placement]
+        watching.discard(old)
+        if not watching:
+          del self.watches[placement]
+
+  def violated(self,placement,assigned):
+    '''
+    a nogood that placement completes, given assigned, the word number
+    of every slot (None if it has none), or None if there is no such
+    nogood
+    '''
+    for nogood in self.watches.get(placement,()):
+      if all(assigned[slot] == wordno for slot, wordno in nogood):
+        self.entries.move_to_end(nogood)
+        self.hits += 1
+        return nogood
+    return None
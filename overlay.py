@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+several word sources layered into one Wordindex: a base list, theme
+lists on top of it, and blocklists taken away from them
+"""
+
+import bisect
+import random
+from typing import Dict, List, Tuple
+from wordindex import Wordindex
+
+class Overlay(Wordindex):
+  '''
+  A Wordindex over the union of the words of some layers, each a
+  Wordindex with a name and a priority, less the words of some
+  blocklists.  A Filler, or anything else wanting a Wordindex, can use
+  one as it is.
+
+  Every layer and blocklist keeps a bitset per length of which of the
+  overlay's words are its own, so full[length], the words in play, is
+  just the OR of the layers' bitsets less the OR of the blocklists'.
+  Turning a layer or a blocklist on or off with setactive() redoes
+  those ORs and nothing else; the letter bitsets cover every word of
+  every layer and never change.
+
+  Words are numbered highest priority first, and within a priority
+  best score first, a word in several layers going with the highest
+  priority one.  So with more than one priority, or any scores, the
+  overlay is scored: its candidates come out in that order, as for any
+  scored Wordindex.  A minimum score then cuts each priority's words
+  separately.
+
+  That order, and the scores, get worked out once, by fromlayers(),
+  from every layer.  setactive() only changes which words are in play,
+  so a word that another layer also has keeps the priority and score a
+  layer that has been turned off gave it.  To take those back too,
+  build a new overlay without the layer.
+  '''
+
+  def __init__(self,seed=0):
+    super().__init__(seed=seed)
+    self.layers = {}        # name -> (priority, { length: bitset of its words })
+    self.blocklists = {}    # name -> { length: bitset of its words }
+    self.inactive = set()   # names of layers and blocklists turned off
+    self.tiers = {}         # length -> [ (first, last+1) word numbers of a priority ], highest first
+
+  @classmethod
+  def fromlayers(cls,layers: List[Tuple[str, Wordindex, int]],
+                 blocklists: List[Tuple[str, Wordindex]] = (),seed=0,minscore=None):
+    '''
+    An overlay of layers, each (name, Wordindex, priority), less the
+    words in blocklists, each (name, Wordindex).  With minscore, words
+    scoring less are left out.
+    '''
+    overlay = cls(seed=seed)
+    priorities = { priority for name, wi, priority in layers }
+    overlay.scored = len(priorities) > 1 or any(wi.scored for name, wi, priority in layers)
+
+    entries = {}    # length -> { word: (priority, score) }, in the order first seen
+    for name, wi, priority in layers:
+      for length, wordlist in wi.words.items():
+        seen = entries.setdefault(length, {})
+        scores = wi.scores.get(length) if wi.scored else None
+        for wordno, word in enumerate(wordlist):
+          entry = (priority, Wordindex.DEFAULT_SCORE if scores is None else scores[wordno])
+          if minscore is not None and entry[1] < minscore:
+            continue
+          if word not in seen or entry > seen[word]:
+            seen[word] = entry
+
+    for length, seen in entries.items():
+      pairs = list(seen.items())
+      if overlay.scored:
+        # ties go in a shuffled order, but the same one whatever the
+        # seed, as in Wordindex.fromwords()
+        random.Random(length).shuffle(pairs)
+        pairs.sort(key=lambda pair: pair[1], reverse=True)
+        overlay.scores[length] = [ score for word, (priority, score) in pairs ]
+      overlay.words[length] = [ word for word, entry in pairs ]
+      tiers = overlay.tiers[length] = []
+      for wordno, (word, (priority, score)) in enumerate(pairs):
+        if wordno == 0 or priority != pairs[wordno-1][1][0]:
+          tiers.append( [wordno, wordno] )
+        tiers[-1][1] = wordno + 1
+    overlay.buildbits()
+
+    for name, wi, priority in layers:
+      overlay.layers[name] = (priority, overlay._bitsfor(wi))
+    for name, wi in blocklists:
+      overlay.blocklists[name] = overlay._bitsfor(wi)
+    overlay.refresh()
+    return overlay
+
+  def _bitsfor(self,wi) -> Dict[int, int]:
+    '''length -> the bitset of this overlay's words that are in wi too'''
+    bits = {}
+    for length, wordlist in self.words.items():
+      if length not in wi.words:
+        continue
+      theirs = set(wi.words[length])
+      flags = bytearray((len(wordlist)+7) // 8)
+      for wordno, word in enumerate(wordlist):
+        if word in theirs:
+          flags[wordno >> 3] |= 1 << (wordno & 7)
+      bits[length] = int.from_bytes(flags, 'little')
+    return bits
+
+  def refresh(self):
+    '''work out which words are in play, from the active layers and blocklists'''
+    for length in self.words:
+      bits = 0
+      for name, (priority, layerbits) in self.layers.items():
+        if name not in self.inactive:
+          bits |= layerbits.get(length,0)
+      for name, blockbits in self.blocklists.items():
+        if name not in self.inactive:
+          bits &= ~blockbits.get(length,0)
+      self.full[length] = bits
+
+  def setactive(self,name,active=True):
+    '''
+    turn a layer or a blocklist on or off: its words come into play or
+    go out of it, but the order and scores of the rest stay as they are
+    '''
+    if name not in self.layers and name not in self.blocklists:
+      raise RuntimeError(f'no word layer or blocklist called {name}')
+    if active:
+      self.inactive.discard(name)
+    else:
+      self.inactive.add(name)
+    self.refresh()
+
+  def tieruns(self, desired_length: int) -> List[int]:
+    '''as for a Wordindex, but no run goes past the end of a priority's words'''
+    if desired_length not in self.ties:
+      starts = set(super().tieruns(desired_length))
+      starts.update(first for first, last in self.tiers.get(desired_length,[]))
+      self.ties[desired_length] = sorted(starts)
+    return self.ties[desired_length]
+
+  def scorecut(self, desired_length: int, minscore: int) -> int:
+    '''
+    the bitset of words of the given length scoring at least minscore:
+    the first so many of each priority's words
+    '''
+    if not self.scored:
+      return super().scorecut(desired_length, minscore)
+    scores = self.scores.get(desired_length,[])
+    bits = 0
+    for first, last in self.tiers.get(desired_length,[]):
+      cut = bisect.bisect_right(scores, -minscore, lo=first, hi=last, key=lambda score: -score)
+      bits |= ((1 << (cut - first)) - 1) << first
+    return bits
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+filling one puzzle with several worker processes at once
+"""
+
+import os
+import queue
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wordindex import Wordindex
+from overlay import Overlay
+from nogoods import Nogoodcache
+from filler import Filler
+from slotgeometry import Slotgeometry
+
+# set in each worker process by _initworker()
+_stopflag = None
+
+# set in each worker process by _inittreeworker()
+_tree = {}
+
+def _initworker(stopflag):
+  global _stopflag
+  _stopflag = stopflag
+
+def loadsource(filename,seed=0,minscore=None):
+  '''a Wordindex from a word db (.db), a compiled index or a word list'''
+  if filename.endswith('.db'):
+    return Wordindex.fromdb(filename,seed=seed,minscore=minscore)
+  if Wordindex.iscompiled(filename):
+    return Wordindex.fromindexfile(filename,seed=seed,minscore=minscore)
+  return Wordindex.fromwordlist(filename,seed=seed,minscore=minscore)
+
+def loadwords(worddb=None,wordlist=None,seed=0,minscore=None,layers=(),blocklists=()):
+  '''
+  a Wordindex from a word list if there is one, else from a word db,
+  opened read-only, leaving out words scoring under minscore.  The word
+  list can be a compiled index from write-word-db.py --index, which
+  gets opened with mmap.
+
+  With layers, a sequence of (filename, priority), or blocklists, a
+  sequence of filenames, the result is an Overlay of those on top of
+  the word list or db, which gets priority 0.
+  '''
+  if layers or blocklists:
+    base = wordlist if wordlist is not None else worddb
+    return Overlay.fromlayers(
+      [ (base, loadwords(worddb=worddb,wordlist=wordlist,seed=seed), 0) ] +
+      [ (filename, loadsource(filename,seed=seed), priority) for filename, priority in layers ],
+      [ (filename, loadsource(filename,seed=seed)) for filename in blocklists ],
+      seed=seed,minscore=minscore)
+  if wordlist is not None and Wordindex.iscompiled(wordlist):
+    return Wordindex.fromindexfile(wordlist,seed=seed,minscore=minscore)
+  if wordlist is not None:
+    return Wordindex.fromwordlist(wordlist,seed=seed,minscore=minscore)
+  return Wordindex.fromdb(worddb,seed=seed,minscore=minscore)
+
+def seedworker(infilename,worddb,wordlist,seed,shuffleties,nogoodsize,geometrycache=None,
+               minscore=None,layers=(),blocklists=(),givens=None):
+  '''
+  runs in a worker process: load the puzzle's geometry and the words,
+  and try to fill the puzzle with the given seed.  Returns the
+  changelist, or None if this seed found no fill or got told to stop.
+  '''
+  wi = loadwords(worddb=worddb,wordlist=wordlist,seed=seed,minscore=minscore,
+                 layers=layers,blocklists=blocklists)
+  puzzle = Slotgeometry.fromjsonfile(infilename,cachedir=geometrycache)
+  nogoods = None
+  if nogoodsize > 0:
+    nogoods = Nogoodcache(maxsize=nogoodsize)
+  filler = Filler(puzzle,wi,
+                  items=Filler.itemorder(puzzle,shuffle=shuffleties,rng=random.Random(seed)),
+                  nogoods=nogoods,seed=seed,givens=givens)
+  if filler.run(stop=_stopflag):
+    _stopflag.set()
+    return filler.changelist()
+  return None
+
+def racefill(infilename,jobs,worddb=None,wordlist=None,seed=0,nogoodsize=100000,
+             geometrycache=None,minscore=None,layers=(),blocklists=(),givens=None):
+  '''
+  Start jobs workers on the same puzzle, each with its own seed (the
+  first with the given one, the rest with seed+1, seed+2, ... and their
+  tied items shuffled too), so that each tries candidates in its own
+  order (see Filler.JITTER), and return the changelist of whichever
+  finishes first, telling the rest to stop.  None if none of them
+  found a fill.  givens are letters the fill has to keep, as for a
+  Filler.
+  '''
+  assert isinstance(jobs,int) and jobs > 0, "jobs must be a positive integer"
+  if seed == 0:
+    seed = Wordindex.clockseed()
+
+  stopflag = multiprocessing.Event()
+  with ProcessPoolExecutor(max_workers=jobs, initializer=_initworker,
+                           initargs=(stopflag,)) as pool:
+    futures = [ pool.submit(seedworker, infilename, worddb, wordlist,
+                            seed+i, i > 0, nogoodsize, geometrycache, minscore,
+                            layers, blocklists, givens)
+                for i in range(jobs) ]
+    try:
+      for future in as_completed(futures):
+        if (changelist := future.result()) is not None:
+          return changelist
+    finally:
+      # whether one found a fill or one failed, the rest can stop,
+      # instead of keeping the pool open until they finish
+      stopflag.set()
+      for f in futures:
+        f.cancel()
+  return None
+
+def _inittreeworker(geometry,worddb,wordlist,seed,minscore,layers,blocklists,givens,distinct,
+                    nogoodsize,tasks,idle,pending,stopflag):
+  # every worker has to number the words and slots the same way, which
+  # loading the same word source and using the same geometry takes
+  # care of; the seed only changes the order candidates get tried in
+  wi = loadwords(worddb=worddb,wordlist=wordlist,seed=seed,minscore=minscore,
+                 layers=layers,blocklists=blocklists)
+  nogoods = None
+  if nogoodsize > 0:
+    nogoods = Nogoodcache(maxsize=nogoodsize)
+  _tree.update(filler=Filler(geometry,wi,nogoods=nogoods,seed=seed+os.getpid(),
+                             givens=givens,distinct=distinct),
+               tasks=tasks, idle=idle, pending=pending, stopflag=stopflag)
+
+def _addtasks(prefixes):
+  # count them as pending before they show up in the queue, so nobody
+  # can see pending hit 0 while there is still work around
+  with _tree['pending'].get_lock():
+    _tree['pending'].value += len(prefixes)
+  for prefix in prefixes:
+    _tree['tasks'].put(prefix)
+
+def _treecheckpoint(filler):
+  if _tree['stopflag'].is_set():
+    return True
+  if _tree['idle'].value > 0 and _tree['tasks'].empty():
+    _addtasks(filler.donate())
+  return False
+
+def _nexttask():
+  '''
+  wait for a prefix to work on; None once the search is over
+  '''
+  idle, pending, stopflag = _tree['idle'], _tree['pending'], _tree['stopflag']
+  with idle.get_lock():
+    idle.value += 1
+  try:
+    while not stopflag.is_set() and pending.value > 0:
+      try:
+        return _tree['tasks'].get(timeout=0.05)
+      except queue.Empty:
+        pass
+    return None
+  finally:
+    with idle.get_lock():
+      idle.value -= 1
+
+def treeworker(countall):
+  '''
+  runs in a worker process: take prefixes off the shared queue and
+  search under them, giving work back whenever another worker is idle.
+  Returns (fills counted, changelist of a fill or None).
+  '''
+  filler = _tree['filler']
+  counted = 0
+  found = None
+  while (prefix := _nexttask()) is not None:
+    try:
+      if countall:
+        counted += filler.count(prefix=prefix,checkpoint=_treecheckpoint)
+      elif filler.start(prefix) and filler.search(checkpoint=_treecheckpoint):
+        found = filler.changelist()
+        counted += 1
+        _tree['stopflag'].set()
+    except BaseException:
+      # the others can't finish without this prefix, so don't leave
+      # them waiting for it
+      _tree['stopflag'].set()
+      raise
+    finally:
+      with _tree['pending'].get_lock():
+        _tree['pending'].value -= 1
+  return counted, found
+
+def treefill(puzzle,jobs,worddb=None,wordlist=None,seed=0,nogoodsize=100000,countall=False,
+             minscore=None,layers=(),blocklists=(),givens=None,distinct=False):
+  '''
+  Split the search tree for puzzle into subtrees and let jobs workers
+  share them, with idle workers taking untried subtrees from busy ones.
+  Without countall, stops at the first fill and returns
+  (1, changelist), or (0, None) once every subtree has been searched
+  and there is no fill.  With countall, searches everything and returns
+  (number of fills, None).  puzzle can be a Puzzlestate or a
+  Slotgeometry, and givens are letters every fill has to keep, as for
+  a Filler.  With distinct, fills differing only in cold cells count
+  as one, as for a Filler.
+  '''
+  assert isinstance(jobs,int) and jobs > 0, "jobs must be a positive integer"
+  if seed == 0:
+    seed = Wordindex.clockseed()
+
+  geometry = puzzle
+  if not isinstance(geometry,Slotgeometry):
+    geometry = Slotgeometry.frompuzzle(puzzle)
+  splitter = Filler(geometry,loadwords(worddb=worddb,wordlist=wordlist,seed=seed,minscore=minscore,
+                                       layers=layers,blocklists=blocklists),seed=seed,
+                    givens=givens,distinct=distinct)
+  prefixes = splitter.split(mintasks=4*jobs)
+
+  tasks = multiprocessing.Queue()
+  idle = multiprocessing.Value('i', 0)
+  pending = multiprocessing.Value('i', len(prefixes))
+  stopflag = multiprocessing.Event()
+  for prefix in prefixes:
+    tasks.put(prefix)
+
+  counted = 0
+  found = None
+  with ProcessPoolExecutor(max_workers=jobs, initializer=_inittreeworker,
+                           initargs=(geometry, worddb, wordlist, seed, minscore, layers,
+                                     blocklists, givens, distinct, nogoodsize, tasks, idle,
+                                     pending, stopflag)) as pool:
+    futures = [ pool.submit(treeworker, countall) for i in range(jobs) ]
+    for future in as_completed(futures):
+      n, changelist = future.result()
+      counted += n
+      if changelist is not None and found is None:
+        found = changelist
+  if not countall:
+    counted = min(counted, 1)
+  return counted, found
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+constraint propagation for the fill search: a live candidate domain
+for every item in a puzzle, kept arc-consistent as words get placed
+"""
+
+from typing import List
+from collections import deque
+from wordindex import _bitpositions
+from fillgrid import Fillgrid
+
+class Propagator:
+  '''
+  Every item ("slot") in the puzzle gets a domain, which is a bitset over
+  the Wordindex word list of that slot's length.  Placing a word shrinks
+  the domains of the crossing slots, and then AC-3 keeps shrinking the
+  domains of slots crossing those, until nothing changes or some
+  domain is empty.  Every change goes on a trail so that undo() can put
+  the domains back the way they were.
+
+  Along with each change we remember its reason: the depths (counting
+  assignments from 0) of the placements that caused it.  The union of
+  a slot's reasons is its conflict set, which is what conflict-directed
+  backjumping needs to know when that slot runs out of words.
+
+  If given a Nogoodcache, a placement that would complete a nogood, a
+  set of placements already known to leave no fill, is turned away
+  before any propagation happens, blaming the other placements in the
+  nogood.  remember() adds new nogoods to it.
+
+  The letters placed so far live in a Fillgrid, which is updated along
+  with the domains.
+
+  Some letters can be given from the start, as { (row, col): letter }.
+  They go in the grid for good, and narrow the domains of the slots
+  they are in before anything else happens.  A slot with every letter
+  given is in self.fixed, with its word, and counts as assigned
+  (to GIVEN) throughout, so it never gets searched; its word doesn't
+  even have to be in the Wordindex.
+
+  Slots are referred to by their position in self.items.
+
+  Setting self.jitter to a random generator makes nextslot() a little
+  less greedy: each slot's candidate count gets scaled by up to
+  1 + SLOTJITTER at random before comparing, so that a restarted search
+  goes down different slots, not just the same ones in the same order.
+  '''
+
+  GIVEN = -1      # what self.assigned holds for a slot in self.fixed
+  SLOTJITTER = 0.5
+
+  def __init__(self,puzzle,wordindex,items=None,arcconsistency=True,nogoods=None,givens=None):
+    self.wi = wordindex
+    self.arcconsistency = arcconsistency
+    self.nogoods = nogoods
+    if items is None:
+      items = puzzle.getitems()
+    self.items = list(items)
+    self.slotno = { item: i for i,item in enumerate(self.items) }
+    self.lengths = [ puzzle.getlength(item) for item in self.items ]
+    self.order = list(range(len(self.items)))   # how nextslot() breaks exact ties
+    self.jitter = None
+
+    # for each slot, a list of (crossing slot, position in this slot,
+    # position in the crossing slot)
+    self.crossings = []
+    for item in self.items:
+      intersectors = puzzle.getintersectors(item)
+      if intersectors is None:
+        intersectors = {}
+      self.crossings.append([ (self.slotno[other], native, foreign)
+                              for other, (native, foreign) in intersectors.items() ])
+
+    self.grid = Fillgrid(puzzle,self.items,self.lengths)
+    self.domains = [ wordindex.full.get(length,0) for length in self.lengths ]
+    self.assigned: List = [ None for item in self.items ]
+    self.depthof: List = [ None for item in self.items ]
+    self.reasons = [ [] for item in self.items ]    # frozensets of depths
+    self.trail = []     # (slot, domain before the change)
+    self.marks = []     # (slot assigned, len(self.trail) before assigning it)
+    self.fixed = {}     # slot -> word, for slots with every letter given
+    if givens:
+      self._give(givens)
+
+  def _give(self,givens):
+    for (row, col), letter in givens.items():
+      self.grid.give(row*self.grid.width + col, letter)
+    for slot in range(len(self.items)):
+      pattern = self.grid.pattern(slot)
+      for position, letter in enumerate(pattern):
+        if letter != '?':
+          self.domains[slot] &= self._letterbits(slot,position).get(letter,0)
+      if '?' not in pattern:
+        self.fixed[slot] = pattern
+        self.assigned[slot] = Propagator.GIVEN
+
+  def _letterbits(self,slot,position):
+    return self.wi.bits[self.lengths[slot]][position]
+
+  def word(self,slot,wordno):
+    return self.wi.words[self.lengths[slot]][wordno]
+
+  def count(self,slot):
+    return self.domains[slot].bit_count()
+
+  def candidates(self,slot):
+    '''the word numbers still possible for this slot'''
+    return _bitpositions(self.domains[slot])
+
+  def unassignedcrossings(self,slot):
+    return sum(1 for other, native, foreign in self.crossings[slot]
+               if self.assigned[other] is None)
+
+  def nextslot(self):
+    '''
+    minimum remaining values: the unassigned slot with the fewest
+    candidates left, ties going to the one with the most unassigned
+    crossings, and after that the one first in self.order.  None once
+    every slot has a word.
+    '''
+    if self.jitter is not None:
+      return self._jitteredslot()
+    best = None
+    bestcount = bestdegree = 0
+    assigned = self.assigned
+    for slot in self.order:
+      if assigned[slot] is not None:
+        continue
+      count = self.domains[slot].bit_count()
+      if best is not None and count > bestcount:
+        continue
+      degree = self.unassignedcrossings(slot)
+      if best is None or count < bestcount or degree > bestdegree:
+        best, bestcount, bestdegree = slot, count, degree
+    return best
+
+  def _jitteredslot(self):
+    '''nextslot(), with the candidate counts scaled by self.jitter's noise'''
+    best = None
+    bestcount = bestdegree = 0
+    assigned = self.assigned
+    for slot in self.order:
+      if assigned[slot] is not None:
+        continue
+      count = self.domains[slot].bit_count() * (1 + Propagator.SLOTJITTER*self.jitter.random())
+      if best is not None and count > bestcount:
+        continue
+      degree = self.unassignedcrossings(slot)
+      if best is None or count < bestcount or degree > bestdegree:
+        best, bestcount, bestdegree = slot, count, degree
+    return best
+
+  def depth(self):
+    '''the depth of the most recent assignment, -1 before the first'''
+    return len(self.marks) - 1
+
+  def conflictset(self,slot):
+    '''the depths of the placements that have narrowed slot's domain'''
+    return frozenset().union(*self.reasons[slot])
+
+  def pattern(self,slot):
+    '''
+    the letters that assigned crossing slots have put in slot, with ?
+    for the rest, e.g. ?A??E
+    '''
+    return self.grid.pattern(slot)
+
+  def remember(self,depths):
+    '''
+    add the placements at these depths to the nogoods, as a set that
+    leaves no fill
+    '''
+    if depths:
+      slots = [ self.marks[depth][0] for depth in depths ]
+      self.nogoods.add(frozenset((slot, self.assigned[slot]) for slot in slots))
+
+  def _restrict(self,slot,newdomain,reason):
+    self.trail.append( (slot, self.domains[slot]) )
+    self.reasons[slot].append(reason)
+    self.domains[slot] = newdomain
+
+  def _supported(self,slot,position,otherslot,otherposition):
+    '''
+    the bitset of words in otherslot whose letter at otherposition
+    appears at position in some word still in slot's domain
+    '''
+    domain = self.domains[slot]
+    otherbits = self._letterbits(otherslot,otherposition)
+    supported = 0
+    for letter, bits in self._letterbits(slot,position).items():
+      if domain & bits:
+        supported |= otherbits.get(letter,0)
+    return supported
+
+  def assign(self,slot,wordno):
+    '''
+    place word number wordno in slot and propagate.  Returns None if
+    every other slot still has candidates, or else the number of the
+    first slot whose domain got wiped out, which is slot itself if the
+    placement completes a nogood.  Either way, undo() backs the
+    assignment out.
+    '''
+    self.marks.append( (slot, len(self.trail)) )
+    self._restrict(slot, 1 << wordno, frozenset())
+    self.assigned[slot] = wordno
+    self.depthof[slot] = self.depth()
+    self.grid.place(slot,self.word(slot,wordno))
+
+    if self.nogoods is not None and \
+       (nogood := self.nogoods.violated((slot, wordno), self.assigned)) is not None:
+      self._restrict(slot,0,frozenset(self.depthof[other] for other, placed in nogood))
+      return slot
+
+    word = self.word(slot,wordno)
+    reason = frozenset((self.depth(),))
+    queue = []
+    for other, native, foreign in self.crossings[slot]:
+      if self.assigned[other] is not None:
+        continue
+      newdomain = self.domains[other] & self._letterbits(other,foreign).get(word[native],0)
+      if newdomain != self.domains[other]:
+        self._restrict(other,newdomain,reason)
+        if not newdomain:
+          return other
+        queue.append(other)
+
+    if not self.arcconsistency:
+      return None
+    return self._ac3(queue)
+
+  def _ac3(self,queue):
+    '''
+    every slot in queue has had its domain shrink, which might leave
+    words in its crossing slots without support
+    '''
+    depth = self.depth()
+    pending = set(queue)
+    queue = deque(queue)
+    while queue:
+      changed = queue.popleft()
+      pending.discard(changed)
+      for other, native, foreign in self.crossings[changed]:
+        if self.assigned[other] is not None:
+          continue
+        newdomain = self.domains[other] & self._supported(changed,native,other,foreign)
+        if newdomain != self.domains[other]:
+          # other lost words because changed did, so it inherits
+          # changed's reasons
+          reason = self.conflictset(changed)
+          if depth >= 0:
+            reason = reason | {depth}
+          self._restrict(other,newdomain,reason)
+          if not newdomain:
+            return other
+          if other not in pending:
+            pending.add(other)
+            queue.append(other)
+    return None
+
+  def establish(self):
+    '''
+    make the starting domains arc-consistent before the search begins.
+    Returns the number of a slot with no possible words, or None.
+    '''
+    unassigned = [ slot for slot in range(len(self.items)) if self.assigned[slot] is None ]
+    for slot in unassigned:
+      if not self.domains[slot]:
+        return slot
+    if not self.arcconsistency:
+      return None
+    return self._ac3(unassigned)
+
+  def undo(self):
+    '''back out the most recent assign()'''
+    slot, mark = self.marks.pop()
+    while len(self.trail) > mark:
+      changed, olddomain = self.trail.pop()
+      self.domains[changed] = olddomain
+      self.reasons[changed].pop()
+    self.grid.remove(slot)
+    self.assigned[slot] = None
+    self.depthof[slot] = None
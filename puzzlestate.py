@@ -132,11 +132,62 @@ class Puzzlestate:
                     for row in range(height)] })
 
 
+  @staticmethod
+  def readjson(filename):
+    '''
+    the json in a json-format file, as it is, for fromjson()
+    '''
+    try:
+      with open(filename,encoding='utf-8') as f:
+        return json.load(f)
+    except Exception as e:
+      raise RuntimeError(f'Could not read json from {filename}') from e
+
+  @staticmethod
+  def blankjson(rows):
+    '''
+    ipuz json for an empty grid given as rows of cells, . for a cell
+    and # for a barrier, with its items numbered the usual way
+    '''
+    height, width = len(rows), len(rows[0])
+    barrier = lambda r,c: (r < 0 or c < 0 or r >= height or c >= width
+                           or rows[r][c] == Puzzlestate.BARRIER)
+    puzzle = []
+    clues = { 'Across': [], 'Down': [] }
+    itemnumber = 1
+    for r in range(height):
+      puzzle.append([])
+      for c in range(width):
+        if barrier(r,c):
+          puzzle[r].append(Puzzlestate.BARRIER)
+          continue
+        across = barrier(r,c-1) and not barrier(r,c+1)
+        down = barrier(r-1,c) and not barrier(r+1,c)
+        if not (across or down):
+          puzzle[r].append(0)
+          continue
+        puzzle[r].append(itemnumber)
+        if across:
+          clues['Across'].append([ itemnumber, '' ])
+        if down:
+          clues['Down'].append([ itemnumber, '' ])
+        itemnumber += 1
+    return { 'dimensions': { 'width': width, 'height': height },
+             'puzzle': puzzle, 'clues': clues }
+
   @classmethod
   def fromjsonfile(cls,filename):
     '''
     populate a puzzle from a json-format file
     '''
+    return cls.fromjson(cls.readjson(filename),filename)
+
+  @classmethod
+  def fromjson(cls,data,filename='json'):
+    '''
+    populate a puzzle from json that's already been read in, like the
+    contents of an ipuz file; filename is just for error messages
+    '''
     def _barrier_or_unset(target,row,col):
       '''
       can be called on 'puzzle' or 'solution'
@@ -145,12 +196,6 @@ class Puzzlestate:
         return Puzzlestate.BARRIER
       return Puzzlestate.UNSET
 
-    try:
-      with open(filename,encoding='utf-8') as f:
-        data = json.load(f)
-    except Exception as e:
-      raise RuntimeError(f'Could not read json from {filename}') from e
-
     # all the validation happens here
 
     if 'puzzle' not in data:
@@ -199,6 +244,13 @@ class Puzzlestate:
         raise RuntimeError(f'File {filename} \'s puzzle is the wrong kind of data structure')
       if len(row) != data['dimensions']['width']:
         raise RuntimeError(f"puzzle row {rownumber} should be {data['dimensions']['width']} columns wide, is {len(row)}")
+      for colnumber, cellcontents in enumerate(row):
+        # ipuz "fancy" cells look like {"cell": 23, "style": {"shapebg": "circle"}};
+        # styles don't matter for filling, so just keep what's in the cell
+        if isinstance(cellcontents, dict):
+          if 'cell' not in cellcontents:
+            raise RuntimeError(f'File {filename} has a fancy cell with nothing in it at [{rownumber},{colnumber}]')
+          row[colnumber] = cellcontents['cell']
 
     # now we start populating other fields of the puzzle object
 
@@ -207,6 +259,9 @@ class Puzzlestate:
 
     if 'wordsused' not in data.keys():
       data['wordsused'] = set()
+    else:
+      # writejson() saves it as a list
+      data['wordsused'] = set(data['wordsused'])
 
     if 'solution' not in data.keys():
       data['solution'] = copy.deepcopy(data['puzzle'])
@@ -255,8 +310,6 @@ class Puzzlestate:
             data['puzzle'][row][col] = Puzzlestate.UNSET
         elif isinstance(cellcontents,str): 
           data['puzzle'][row][col] = data['puzzle'][row][col].upper()
-        elif isinstance(cellcontents, dict):
-          raise RuntimeError("I don't know how to deal with fancy cells yet")
         else:
           raise RuntimeError(f"weird cell content: [{row},{col}] is {cellcontents}, type {type(cellcontents)}")
     # now squirrel away the length of the answer for each item,
@@ -744,6 +797,25 @@ class Puzzlestate:
       col += col_increment
     return True
 
+  def givenletters(self):
+    '''the letters already in the solution, as { (row, col): letter }'''
+    return { (row, col): c.upper()
+             for row, cells in enumerate(self.data['solution'])
+             for col, c in enumerate(cells)
+             if isinstance(c,str) and c.isascii() and c.isalpha() }
+
+  def clearletters(self):
+    '''take every letter back out of the solution'''
+    for (row, col) in self.givenletters():
+      self.data['solution'][row][col] = Puzzlestate.UNSET
+    return self
+
+  def setletters(self,letters):
+    '''put letters, as { (row, col): letter }, in the solution'''
+    for (row, col), c in letters.items():
+      self.setchar(row,col,c)
+    return self
+
   def inscribe_word_in_solution(self,item,word):
     """
     returns object containing the word if it was able to inscribe it,
@@ -823,6 +895,9 @@ class Puzzlestate:
           print("¿ ", end='')
       print()
 
+  def getitems(self):
+    return list(self.data['items_expanded'])
+
   def getintersectors(self,item) -> Dict:
     if 'intersectors' not in self.data['items_expanded'][item]:
       return None
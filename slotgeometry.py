@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+the parts of a Puzzlestate the fill search needs, compiled into flat
+int arrays that are cheap to pickle, to cache on disk, and to load
+back with mmap
+"""
+
+import os
+import copy
+import struct
+import hashlib
+from array import array
+from typing import Dict
+from puzzlestate import Puzzlestate, Puzzleitem, Puzzlegeometry
+from mmapfile import writeatomic, openmapped
+
+DIRECTIONS = list(Puzzlegeometry.directions)    # direction codes are indexes into this
+
+class Slotgeometry:
+  '''
+  The shape of a puzzle and nothing else.  Slot i (the i'th item) has
+  itemnumbers[i], directions[i], starts[i] (the cell number of its
+  first cell, row*width + col) and lengths[i].  Its crossings are
+  entries crossstart[i] up to crossstart[i+1] of crossslots (the slot
+  crossed), crossnative (the offset in slot i) and crossforeign (the
+  offset in the slot crossed).
+
+  It answers the same questions the fill search asks a Puzzlestate
+  (getitems, getlength, getintersectors, answerlocation, width,
+  height, sparseness), so a Filler can be built from either.
+
+  The binary form, from tobytes(), is a HEADER followed by those arrays
+  as 32-bit ints, in ARRAYS order.  frombuffer() reads the arrays
+  straight out of a buffer, such as an mmap, without copying them.
+  '''
+  MAGIC = b'GCSG'
+  VERSION = 1
+  HEADER = struct.Struct('<4sIIIIII')   # magic, version, width, height, slots, crossings, barriers
+  ARRAYS = ('itemnumbers', 'directions', 'starts', 'lengths', 'crossstart',
+            'crossslots', 'crossnative', 'crossforeign')
+
+  def __init__(self,width,height,barriers,**arrays):
+    self._width = width
+    self._height = height
+    self.barriers = barriers
+    for name in Slotgeometry.ARRAYS:
+      setattr(self, name, arrays[name])
+
+    self.items = [ Puzzleitem(itemnumber=int(n), direction=DIRECTIONS[d])
+                   for n, d in zip(self.itemnumbers, self.directions) ]
+    self.slotno = { item: i for i,item in enumerate(self.items) }
+    self.startof = { int(n): int(start) for n, start in zip(self.itemnumbers, self.starts) }
+
+  @classmethod
+  def frompuzzle(cls,puzzle):
+    width = puzzle.width()
+    items = puzzle.getitems()
+    slotno = { item: i for i,item in enumerate(items) }
+    arrays = { name: array('i') for name in Slotgeometry.ARRAYS }
+    arrays['crossstart'].append(0)
+    for item in items:
+      row,col = puzzle.answerlocation(item.itemnumber)
+      arrays['itemnumbers'].append(item.itemnumber)
+      arrays['directions'].append(DIRECTIONS.index(item.direction))
+      arrays['starts'].append(row*width + col)
+      arrays['lengths'].append(puzzle.getlength(item))
+      for other, (native, foreign) in (puzzle.getintersectors(item) or {}).items():
+        arrays['crossslots'].append(slotno[other])
+        arrays['crossnative'].append(native)
+        arrays['crossforeign'].append(foreign)
+      arrays['crossstart'].append(len(arrays['crossslots']))
+    barriers = sum(1 for row in puzzle.data['puzzle'] for c in row if c == Puzzlestate.BARRIER)
+    return cls(width, puzzle.height(), barriers, **arrays)
+
+  def tobytes(self) -> bytes:
+    header = Slotgeometry.HEADER.pack(Slotgeometry.MAGIC, Slotgeometry.VERSION,
+                                      self._width, self._height, len(self.items),
+                                      len(self.crossslots), self.barriers)
+    return header + b''.join(array('i', getattr(self, name)).tobytes()
+                             for name in Slotgeometry.ARRAYS)
+
+  @classmethod
+  def frombuffer(cls,buf):
+    magic, version, width, height, nslots, ncrossings, barriers = \
+      Slotgeometry.HEADER.unpack_from(buf)
+    if magic != Slotgeometry.MAGIC or version != Slotgeometry.VERSION:
+      raise RuntimeError('not a slot geometry, or one from a different version')
+    ints = memoryview(buf)[Slotgeometry.HEADER.size:].cast('i')
+    sizes = [ nslots, nslots, nslots, nslots, nslots+1, ncrossings, ncrossings, ncrossings ]
+    arrays = {}
+    offset = 0
+    for name, size in zip(Slotgeometry.ARRAYS, sizes):
+      arrays[name] = ints[offset:offset+size]
+      offset += size
+    return cls(width, height, barriers, **arrays)
+
+  def __reduce__(self):
+    # it may be mapped from the cache (see mmapfile), so it goes as
+    # its binary form
+    return (Slotgeometry.frombuffer, (self.tobytes(),))
+
+  @staticmethod
+  def cachekey(data) -> str:
+    '''
+    a hash of a puzzle's barrier pattern, given its json, along with
+    its dimensions and item numbering
+    '''
+    h = hashlib.sha1()
+    h.update(f"{data['dimensions']['width']}x{data['dimensions']['height']}".encode())
+    for row in data['puzzle']:
+      cells = ( c.get('cell') if isinstance(c, dict) else c for c in row )
+      h.update(''.join('#' if c == Puzzlestate.BARRIER else '.' for c in cells).encode())
+    for direction in sorted(data['clues']):
+      h.update(direction.encode())
+      h.update(','.join(str(int(clue[0])) for clue in data['clues'][direction]).encode())
+    return h.hexdigest()
+
+  @classmethod
+  def fromjson(cls,data,filename='json',cachedir=None):
+    '''
+    The geometry of a puzzle given its json, already read in, like the
+    contents of an ipuz file.  With a cachedir, look there for a
+    geometry compiled from a grid with the same barriers, and mmap it
+    if it is there; otherwise parse the puzzle and save its geometry
+    there for next time.  data is left as it was, so the puzzle can
+    still be made from it with Puzzlestate.fromjson() if it is wanted.
+    '''
+    if cachedir is None:
+      return cls.frompuzzle(Puzzlestate.fromjson(copy.deepcopy(data),filename))
+
+    cachefile = os.path.join(cachedir, Slotgeometry.cachekey(data) + '.geom')
+    if os.path.exists(cachefile):
+      return cls.frombuffer(openmapped(cachefile))
+
+    # Puzzlestate.fromjson() changes what it is given
+    geometry = cls.frompuzzle(Puzzlestate.fromjson(copy.deepcopy(data),filename))
+    os.makedirs(cachedir, exist_ok=True)
+    writeatomic(cachefile, geometry.tobytes())
+    return geometry
+
+  @classmethod
+  def fromjsonfile(cls,filename,cachedir=None):
+    '''the geometry of an ipuz file, with cachedir as for fromjson()'''
+    if cachedir is None:
+      return cls.frompuzzle(Puzzlestate.fromjsonfile(filename))
+    return cls.fromjson(Puzzlestate.readjson(filename),filename,cachedir=cachedir)
+
+  def width(self):
+    return self._width
+
+  def height(self):
+    return self._height
+
+  def getitems(self):
+    return list(self.items)
+
+  def getlength(self,item) -> int:
+    return self.lengths[self.slotno[item]]
+
+  def getintersectors(self,item) -> Dict:
+    slot = self.slotno[item]
+    return { self.items[self.crossslots[k]]: (self.crossnative[k], self.crossforeign[k])
+             for k in range(self.crossstart[slot], self.crossstart[slot+1]) }
+
+  def answerlocation(self,itemnumber):
+    return list(divmod(self.startof[itemnumber], self._width))
+
+  def sparseness(self):
+    return self.barriers / (self._width * self._height)
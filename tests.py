@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+checks that the filler finds every fill of some small grids, by
+counting them again by brute force, and that the word sources and
+compiled files behave
+
+usage: python -m unittest tests  (or pytest tests.py)
+"""
+
+import os
+import sys
+import copy
+import pickle
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from puzzlestate import Puzzlestate
+from wordindex import Wordindex
+from slotgeometry import Slotgeometry
+from overlay import Overlay
+from wordfountain import Wordfountain
+from nogoods import Nogoodcache
+from filler import Filler
+from parallelfill import treefill
+
+WORDS = [ 'ACE', 'ACT', 'AGE', 'ATE', 'BAT', 'BET', 'CAB', 'CAT', 'EAR', 'EAT',
+          'ERA', 'GAS', 'OAR', 'ORE', 'RAT', 'SEA', 'SET', 'TAB', 'TAR', 'TEA',
+          'TEE', 'TOE', 'TAN', 'NET', 'ANT', 'ARE' ]
+
+GRIDS = {
+  'open': [ '...', '...', '...' ],
+  # the middle of every side is a cold cell, in just one word
+  'ring': [ '...', '.#.', '...' ],
+}
+
+def slotcells(rows):
+  '''the cells of every run of two or more open cells, across then down'''
+  height, width = len(rows), len(rows[0])
+  runs = []
+  for lines in ([ [ (r,c) for c in range(width) ] for r in range(height) ],
+                [ [ (r,c) for r in range(height) ] for c in range(width) ]):
+    for line in lines:
+      run = []
+      for cell in line:
+        if rows[cell[0]][cell[1]] == Puzzlestate.BARRIER:
+          if len(run) > 1:
+            runs.append(run)
+          run = []
+        else:
+          run.append(cell)
+      if len(run) > 1:
+        runs.append(run)
+  return runs
+
+def bruteforce(rows,words,givens=None):
+  '''
+  every fill of the grid, as { cell: letter }, found by trying every
+  word in every slot in turn
+  '''
+  slots = slotcells(rows)
+  fills = []
+  def place(i,letters):
+    if i == len(slots):
+      fills.append(dict(letters))
+      return
+    for word in words:
+      if len(word) != len(slots[i]):
+        continue
+      if all(letters.get(cell,letter) == letter for cell, letter in zip(slots[i],word)):
+        added = [ cell for cell in slots[i] if cell not in letters ]
+        letters.update(zip(slots[i],word))
+        place(i+1,letters)
+        for cell in added:
+          del letters[cell]
+  place(0,dict(givens or {}))
+  return fills
+
+def distinctfills(rows,fills):
+  '''how many fills there are, taking ones that differ only in cold cells as one'''
+  slots = slotcells(rows)
+  checked = sorted({ cell for slot in slots for cell in slot
+                     if sum(cell in other for other in slots) > 1 })
+  return len({ tuple(fill[cell] for cell in checked) for fill in fills })
+
+class Testcounts(unittest.TestCase):
+
+  def setUp(self):
+    self.wi = Wordindex.fromwords(WORDS,seed=1)
+
+  def puzzle(self,name):
+    return Puzzlestate.fromjson(Puzzlestate.blankjson(GRIDS[name]),name)
+
+  def expected(self,name,givens=None,distinct=False):
+    fills = bruteforce(GRIDS[name],WORDS,givens)
+    return distinctfills(GRIDS[name],fills) if distinct else len(fills)
+
+  def sharedcount(self,puzzle,givens=None,distinct=False):
+    '''
+    count the way tree workers do, with one Filler giving away work at
+    every chance and then counting the prefixes it gave away
+    '''
+    filler = Filler(puzzle,self.wi,nogoods=Nogoodcache(),seed=1,givens=givens,distinct=distinct)
+    tasks = [ [] ]
+    total = 0
+    def checkpoint(f):
+      tasks.extend(f.donate())
+      return False
+    with mock.patch.object(Filler,'STOP_CHECK_NODES',1):
+      while tasks:
+        total += filler.count(prefix=tasks.pop(),checkpoint=checkpoint)
+    return total, filler
+
+  def cases(self):
+    for name in GRIDS:
+      for givens in (None, { (0,0): 'T' }, { (0,1): 'A', (2,2): 'T' }):
+        for distinct in (False, True):
+          yield name, givens, distinct
+
+  def test_count(self):
+    for name, givens, distinct in self.cases():
+      expected = self.expected(name,givens,distinct)
+      for nogoods in (None, Nogoodcache()):
+        with self.subTest(grid=name,givens=givens,distinct=distinct,nogoods=nogoods is not None):
+          filler = Filler(self.puzzle(name),self.wi,nogoods=nogoods,seed=1,
+                          givens=givens,distinct=distinct)
+          self.assertEqual(filler.count(), expected)
+
+  def test_fills(self):
+    for name, givens, distinct in self.cases():
+      with self.subTest(grid=name,givens=givens,distinct=distinct):
+        filler = Filler(self.puzzle(name),self.wi,nogoods=Nogoodcache(),seed=1,
+                        givens=givens,distinct=distinct)
+        self.assertEqual(sum(1 for fill in filler.fills()), self.expected(name,givens,distinct))
+
+  def test_donate(self):
+    for name, givens, distinct in self.cases():
+      with self.subTest(grid=name,givens=givens,distinct=distinct):
+        total, filler = self.sharedcount(self.puzzle(name),givens,distinct)
+        self.assertEqual(total, self.expected(name,givens,distinct))
+
+  def test_fill(self):
+    for name in GRIDS:
+      with self.subTest(grid=name):
+        filler = Filler(self.puzzle(name),self.wi,nogoods=Nogoodcache(),seed=1)
+        changelist = filler.fill()
+        self.assertIsNotNone(changelist)
+        words = [ word for item, word, depth in changelist ]
+        self.assertEqual(len(words), len(slotcells(GRIDS[name])))
+        self.assertTrue(set(words) <= set(WORDS))
+
+  def test_treefill(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      wordlist = os.path.join(tmp,'words.txt')
+      with open(wordlist,'w',encoding='latin-1') as f:
+        f.write('\n'.join(WORDS) + '\n')
+      for name in GRIDS:
+        with self.subTest(grid=name):
+          counted, found = treefill(self.puzzle(name),2,wordlist=wordlist,seed=1,countall=True)
+          self.assertEqual(counted, self.expected(name))
+          counted, found = treefill(self.puzzle(name),2,wordlist=wordlist,seed=1,countall=True,
+                                    distinct=True)
+          self.assertEqual(counted, self.expected(name,distinct=True))
+
+SCOREDWORDS = [ 'ACE;60', 'ACT;40', 'AGE;60', 'BAT', 'CAT;20', 'TOE;70', 'ANTS;30', 'TEAS;80' ]
+
+class Testcompiledindex(unittest.TestCase):
+
+  def assertsame(self,compiled,wi,minscore=None):
+    self.assertEqual(compiled.scored, wi.scored)
+    for length in wi.words:
+      with self.subTest(length=length,minscore=minscore):
+        self.assertEqual(list(compiled.words[length]), list(wi.words[length]))
+        self.assertEqual(compiled.full[length], wi.full[length])
+        self.assertEqual(compiled.bits[length],
+                         [ { letter: bits for letter, bits in position.items() if bits }
+                           for position in wi.bits[length] ])
+        if wi.scored:
+          self.assertEqual(list(compiled.scores[length]), list(wi.scores[length]))
+        for constraints in ([], [ (0,'A') ], [ (1,'E'), (2,'A') ]):
+          self.assertEqual(compiled.candidates(length,constraints),
+                           wi.candidates(length,constraints))
+
+  def test_roundtrip(self):
+    for words in (WORDS, SCOREDWORDS):
+      wi = Wordindex.fromwords(words,seed=1)
+      self.assertsame(Wordindex.frombuffer(wi.tobytes(),seed=1), wi)
+
+  def test_minscore(self):
+    for words in (WORDS, SCOREDWORDS):
+      buf = Wordindex.fromwords(words,seed=1).tobytes()
+      for minscore in (0, 50, 60, 75, 100):
+        self.assertsame(Wordindex.frombuffer(buf,seed=1,minscore=minscore),
+                        Wordindex.fromwords(words,seed=1,minscore=minscore), minscore)
+
+  def test_indexfile(self):
+    wi = Wordindex.fromwords(SCOREDWORDS,seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp,'words.wix')
+      wi.writeindex(filename)
+      self.assertTrue(Wordindex.iscompiled(filename))
+      compiled = Wordindex.fromindexfile(filename,seed=1,minscore=50)
+      self.assertsame(compiled, Wordindex.fromwords(SCOREDWORDS,seed=1,minscore=50))
+      # it pickles as its filename, and keeps its minscore
+      self.assertsame(pickle.loads(pickle.dumps(compiled)), compiled)
+      self.assertEqual(compiled.__reduce_ex__(2)[1][0], filename)
+
+class Testslotgeometry(unittest.TestCase):
+
+  def assertsame(self,geometry,puzzle):
+    self.assertEqual((geometry.width(), geometry.height()), (puzzle.width(), puzzle.height()))
+    self.assertEqual(geometry.getitems(), puzzle.getitems())
+    for item in puzzle.getitems():
+      self.assertEqual(geometry.getlength(item), puzzle.getlength(item))
+      self.assertEqual(geometry.getintersectors(item), puzzle.getintersectors(item))
+
+  def test_cache(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      for name in GRIDS:
+        with self.subTest(grid=name):
+          data = Puzzlestate.blankjson(GRIDS[name])
+          before = copy.deepcopy(data)
+          puzzle = Puzzlestate.fromjson(copy.deepcopy(data),name)
+          missed = Slotgeometry.fromjson(data,name,cachedir=tmp)
+          self.assertEqual(data, before)
+          cachefile = os.path.join(tmp, Slotgeometry.cachekey(data) + '.geom')
+          self.assertTrue(os.path.exists(cachefile))
+          self.assertsame(missed, puzzle)
+          # the second time, it comes out of the cache, without the
+          # puzzle being parsed at all
+          with mock.patch.object(Puzzlestate,'fromjson',side_effect=AssertionError):
+            hit = Slotgeometry.fromjson(data,name,cachedir=tmp)
+          self.assertsame(hit, puzzle)
+          self.assertsame(pickle.loads(pickle.dumps(hit)), puzzle)
+      # one cache file for each grid
+      self.assertEqual(len(os.listdir(tmp)), len(GRIDS))
+
+FOUNTAINWORDS = [ ('CAT', 50), ('COT', None), ('CUT', 70), ('DOG', 90), ('COG', 70), ('EMU', 30),
+                  ('CRABAPPLE', 80), ('CROSSWORD', None), ('SWORDFISH', 60), ('CRAWFISHE', 20) ]
+
+def writedb(filename,schema,words):
+  '''a word db of words, (word, score) pairs, in the given schema'''
+  con = sqlite3.connect(filename)
+  with con:
+    if schema == 1:
+      con.execute('''CREATE TABLE words (word text NOT NULL, length INTEGER,
+                     c0 TEXT, c1 TEXT, c2 TEXT, c3 TEXT, c4 TEXT, c5 TEXT, c6 TEXT, c7 TEXT)''')
+      con.executemany('INSERT INTO words VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      [ (word, len(word), *(word[:8].ljust(8)))
+                        for word, score in words ])
+    else:
+      con.execute(f'PRAGMA user_version = {schema}')
+      scorecolumn = ', score INTEGER' if schema >= 3 else ''
+      con.execute(f'CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE, '
+                  f'length INTEGER NOT NULL{scorecolumn})')
+      con.execute('''CREATE TABLE letters (length INTEGER NOT NULL, position INTEGER NOT NULL,
+                     letter TEXT NOT NULL, wordid INTEGER NOT NULL)''')
+      for wordid, (word, score) in enumerate(words, start=1):
+        row = (wordid, word, len(word), score) if schema >= 3 else (wordid, word, len(word))
+        con.execute(f"INSERT INTO words VALUES ({','.join('?' * len(row))})", row)
+        con.executemany('INSERT INTO letters VALUES (?, ?, ?, ?)',
+                        [ (len(word), i, c, wordid) for i, c in enumerate(word) ])
+      con.execute('CREATE INDEX letters_by_pattern ON letters (length, position, letter, wordid)')
+  con.close()
+
+class Testwordfountain(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.fountains = {}
+    for schema in (1, 2, 3):
+      filename = os.path.join(self.tmp.name, f'schema{schema}.db')
+      writedb(filename, schema, FOUNTAINWORDS)
+      self.fountains[schema] = Wordfountain(filename,seed=1)
+    self.wi = Wordindex.fromwords(FOUNTAINWORDS,seed=1)
+
+  def tearDown(self):
+    for fountain in self.fountains.values():
+      fountain.con.close()
+    self.tmp.cleanup()
+
+  def test_matches(self):
+    for length, constraints in ((3, []), (3, [ (0,'C') ]), (3, [ (0,'C'), (2,'T') ]),
+                                (3, [ (1,'X') ]), (9, [ (0,'C'), (1,'R') ]),
+                                (9, [ (8,'H') ]), (9, [ (5,'W'), (8,'D') ]), (4, [])):
+      expected = sorted(self.wi.matchingwords(length,constraints))
+      for schema, fountain in self.fountains.items():
+        with self.subTest(schema=schema,length=length,constraints=constraints):
+          self.assertEqual(sorted(fountain.matchingwords(length,constraints)), expected)
+
+  def test_scored(self):
+    self.assertEqual([ f.scored for f in self.fountains.values() ], [ False, False, True ])
+    fountain = self.fountains[3]
+    # best first, no score counting as DEFAULT_SCORE, ties in either order
+    words = fountain.matchingwords(3,[])
+    self.assertEqual(words[0], 'DOG')
+    self.assertEqual(set(words[1:3]), { 'CUT', 'COG' })
+    self.assertEqual(set(words[3:5]), { 'CAT', 'COT' })
+    self.assertEqual(words[5:], [ 'EMU' ])
+    self.assertEqual(sorted(fountain.matchingwords(3,[ (0,'C') ],minscore=60)), [ 'COG', 'CUT' ])
+    self.assertEqual(fountain.matchingwords(9,[ (0,'C') ],minscore=50),
+                     [ 'CRABAPPLE', 'CROSSWORD' ])
+    # without scores, every word counts as DEFAULT_SCORE
+    for schema in (1, 2):
+      self.assertEqual(len(self.fountains[schema].matchingwords(3,[],minscore=50)), 6)
+      self.assertEqual(self.fountains[schema].matchingwords(3,[],minscore=51), [])
+
+  def test_fetching(self):
+    # only so many words get fetched at a time, but they all come
+    with mock.patch.object(Wordfountain,'FETCH_WORDS',2):
+      for schema in (2, 3):
+        with self.subTest(schema=schema):
+          self.assertEqual(sorted(self.fountains[schema].iterwords(3,[])),
+                           sorted(word for word, score in FOUNTAINWORDS if len(word) == 3))
+
+class Testnogoodcache(unittest.TestCase):
+
+  def test_violated(self):
+    cache = Nogoodcache()
+    nogood = frozenset([ (0,3), (2,5) ])
+    cache.add(nogood)
+    assigned = [ 3, None, None ]
+    self.assertIsNone(cache.violated((0,3),assigned))
+    assigned[2] = 5
+    self.assertEqual(cache.violated((2,5),assigned), nogood)
+    self.assertEqual(cache.violated((0,3),assigned), nogood)
+    assigned[2] = 4
+    self.assertIsNone(cache.violated((2,4),assigned))
+    self.assertEqual(cache.hits, 2)
+
+  def test_eviction(self):
+    cache = Nogoodcache(maxsize=2)
+    first, second, third = ( frozenset([ (0,i), (1,i) ]) for i in range(3) )
+    cache.add(first)
+    cache.add(second)
+    # using the first makes the second the least recently used
+    self.assertEqual(cache.violated((0,0),[ 0, 0 ]), first)
+    cache.add(third)
+    self.assertEqual(len(cache), 2)
+    self.assertIn(first, cache)
+    self.assertNotIn(second, cache)
+    # and nothing watches for it any more
+    self.assertNotIn((0,1), cache.watches)
+    self.assertNotIn((1,1), cache.watches)
+    self.assertIsNone(cache.violated((0,1),[ 1, 1 ]))
+    self.assertEqual(cache.watches[(0,2)], { third })
+    # adding one again only freshens it
+    cache.add(first)
+    cache.add(frozenset([ (0,0), (2,7) ]))
+    self.assertEqual(set(cache.entries), { first, frozenset([ (0,0), (2,7) ]) })
+    self.assertEqual(len(cache.watches[(0,0)]), 2)
+    self.assertNotIn((0,2), cache.watches)
+
+class Testoverlay(unittest.TestCase):
+
+  def setUp(self):
+    base = Wordindex.fromwords([ 'CAT;50', 'DOG;90', 'EMU;40', 'GNU;70', 'OWL;60' ],seed=1)
+    theme = Wordindex.fromwords([ 'EMU;30', 'YAK;80', 'ASP;20' ],seed=1)
+    block = Wordindex.fromwords([ 'DOG', 'ASP' ],seed=1)
+    self.overlay = Overlay.fromlayers([ ('base', base, 0), ('theme', theme, 5) ],
+                                      [ ('block', block) ],seed=1)
+
+  def inplay(self,minscore=None):
+    return self.overlay.matchingwords(3,[],minscore)
+
+  def test_order(self):
+    # the theme's words first, best first, then the base's; EMU goes
+    # with the theme, as its higher priority layer, and its score there
+    self.assertEqual(self.overlay.words[3], [ 'YAK', 'EMU', 'ASP', 'DOG', 'GNU', 'OWL', 'CAT' ])
+    self.assertEqual(list(self.overlay.scores[3]), [ 80, 30, 20, 90, 70, 60, 50 ])
+    self.assertEqual(self.inplay(), [ 'YAK', 'EMU', 'GNU', 'OWL', 'CAT' ])
+    # a run of ties never crosses from one priority to the next
+    self.assertEqual(self.overlay.tieruns(3), [ 0, 1, 2, 3, 4, 5, 6, 7 ])
+
+  def test_blocklist(self):
+    self.overlay.setactive('block',False)
+    self.assertEqual(self.inplay(), [ 'YAK', 'EMU', 'ASP', 'DOG', 'GNU', 'OWL', 'CAT' ])
+    self.overlay.setactive('theme',False)
+    # the base's own words, in the order they had with the theme on
+    self.assertEqual(self.inplay(), [ 'EMU', 'DOG', 'GNU', 'OWL', 'CAT' ])
+    self.overlay.setactive('block')
+    self.assertEqual(self.inplay(), [ 'EMU', 'GNU', 'OWL', 'CAT' ])
+    with self.assertRaises(RuntimeError):
+      self.overlay.setactive('nosuchlayer')
+
+  def test_scorecut(self):
+    # each priority's words get cut separately
+    self.assertEqual(self.inplay(minscore=60), [ 'YAK', 'GNU', 'OWL' ])
+    self.assertEqual(self.overlay.scorecut(3,60), 0b0111001)
+    self.assertEqual(self.overlay.scorecut(3,100), 0)
+    self.assertEqual(self.overlay.scorecut(3,0), 0b1111111)
+    self.assertEqual(self.overlay.candidates(3,[ (0,'Y') ],minscore=90), 0)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def writewordlist(directory,lines,name='words.txt'):
+  filename = os.path.join(directory,name)
+  with open(filename,'w',encoding='latin-1') as f:
+    f.write('\n'.join(lines) + '\n')
+  return filename
+
+class Testwriteworddb(unittest.TestCase):
+
+  def writedb(self,tmp,lines,*options):
+    wordlist = writewordlist(tmp,lines)
+    db = os.path.join(tmp,'words.db')
+    result = subprocess.run([ sys.executable, os.path.join(HERE,'write-word-db.py'), '-f',
+                              '-o', db, *options, wordlist ],
+                            capture_output=True, text=True)
+    return result, db
+
+  def test_duplicates(self):
+    lines = [ 'CAT;10', 'DOG', 'cat;30', 'DOG;5', 'CAT', 'EMU', 'emu;3', 'two words', '' ]
+    with tempfile.TemporaryDirectory() as tmp:
+      for jobs in ('1', '2'):
+        with self.subTest(jobs=jobs):
+          result, db = self.writedb(tmp,lines,'-j',jobs,'--index',os.path.join(tmp,'words.wix'))
+          self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+          con = sqlite3.connect(db)
+          # first seen first, each with its best score
+          self.assertEqual(con.execute('SELECT id, word, length, score FROM words ORDER BY id').fetchall(),
+                           [ (1, 'CAT', 3, 30), (2, 'DOG', 3, 5), (3, 'EMU', 3, 3) ])
+          self.assertEqual(con.execute('''SELECT group_concat(letter, '') FROM
+                                          (SELECT * FROM letters ORDER BY wordid, position)
+                                          GROUP BY wordid ORDER BY wordid''').fetchall(),
+                           [ ('CAT',), ('DOG',), ('EMU',) ])
+          con.close()
+          self.assertIn('4 duplicates', result.stdout)
+          compiled = Wordindex.fromindexfile(os.path.join(tmp,'words.wix'))
+          self.assertEqual(list(compiled.words[3]), [ 'CAT', 'DOG', 'EMU' ])
+          self.assertEqual(list(compiled.scores[3]), [ 30, 5, 3 ])
+
+  def test_badscore(self):
+    # the same mistake -w won't take
+    lines = [ 'CAT;10', 'DOG;many' ]
+    with tempfile.TemporaryDirectory() as tmp:
+      result, db = self.writedb(tmp,lines)
+      self.assertNotEqual(result.returncode, 0)
+      self.assertIn('DOG;many', result.stdout)
+      self.assertFalse(os.path.exists(db))
+      with self.assertRaises(RuntimeError):
+        Wordindex.fromwordlist(writewordlist(tmp,lines))
+
+if __name__ == '__main__':
+  unittest.main()
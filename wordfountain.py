@@ -8,9 +8,12 @@ import sys
 import os
 import re
 import sqlite3
+import pathlib
 import os.path
 import functools
-from typing import List, Tuple
+import itertools
+from typing import Iterator, List, Tuple
+from wordindex import _lazyshuffle
 
 class Wordfountain:
   def __init__(self,worddb=None,seed=0):
@@ -24,27 +27,125 @@ class Wordfountain:
 #      assert os.path.isdir(home), "you lack a homedir"
 #      worddb = os.path.join(home,'.crossword', worddb)
 
-    if seed == 0:
-      random.seed(int(time.time()))
-    else:
-      random.seed(seed)
+    self.random = random.Random(int(time.time()) if seed == 0 else seed)
 
-    self.con = sqlite3.connect('file://' + worddb + '?mode=ro', uri=True)
+    self.con = sqlite3.connect(pathlib.Path(worddb).resolve().as_uri() + '?mode=ro', uri=True)
     self.con.row_factory = lambda cursor, row: row[0]
+    self.schema = self.con.execute('PRAGMA user_version;').fetchone()
+    self.scored = self.schema >= 3 and bool(self.con.execute(
+      'SELECT EXISTS (SELECT 1 FROM words WHERE score IS NOT NULL);').fetchone())
+
+  # schema 1 (written by older versions of write-word-db.py) only has
+  # columns c0..c7, so constraints past the 8th letter get checked here
+  SCHEMA1_MAX_INDEXED = 8
+
+  # what words without a score count as, in a db with scores
+  DEFAULT_SCORE = 50
+
+  # how many words iterwords() fetches at a time, once it has picked
+  # which ones come next
+  FETCH_WORDS = 64
 
-  def matchingwords(self, desired_length: int, constraints: List[Tuple]) -> List:
-    query = 'SELECT word FROM words WHERE length = ' + str(desired_length)
+  def _query_schema1(self, desired_length: int, constraints: List[Tuple]) -> List:
+    query = 'SELECT word FROM words WHERE length = ?'
+    params = [desired_length]
+    unindexed = []
     for c in constraints:
-      query += ' AND c' + str(c[0]) + " = '" + str(c[1]) + "'"
+      if c[0] < Wordfountain.SCHEMA1_MAX_INDEXED:
+        query += ' AND c' + str(int(c[0])) + ' = ?'
+        params.append(str(c[1]))
+      else:
+        unindexed.append(c)
 
     query += ';'
 
-    cur = self.con.cursor()
+    matches = self.con.cursor().execute(query, params).fetchall()
+    if unindexed:
+      matches = [ w for w in matches
+                  if all(w[c[0]] == c[1] for c in unindexed) ]
+    return matches
 
-    matches = cur.execute(query).fetchall()
+  def _query_schema2(self, desired_length: int, constraints: List[Tuple], minscore=None,
+                     column='word') -> sqlite3.Cursor:
+    '''
+    a cursor over the matching words, or with column='id', their ids,
+    or with more than one column, whole rows
+    '''
+    query = f'SELECT {column} FROM words WHERE length = ?'
+    params = [ desired_length ]
+    if constraints:
+      # each subquery is a range scan on the (length, position, letter, wordid) index
+      subquery = 'SELECT wordid FROM letters WHERE length = ? AND position = ? AND letter = ?'
+      query += ' AND id IN (' + ' INTERSECT '.join([subquery] * len(constraints)) + ')'
+      for c in constraints:
+        params.extend( (desired_length, int(c[0]), str(c[1])) )
 
-    random.shuffle(matches)
-    return matches
+    if self.scored:
+      if minscore is not None:
+        query += ' AND ifnull(score, ?) >= ?'
+        params.extend( (Wordfountain.DEFAULT_SCORE, minscore) )
+      # best first; iterwords() shuffles the ties, with self.random
+      query += ' ORDER BY ifnull(score, ?) DESC'
+      params.append(Wordfountain.DEFAULT_SCORE)
+
+    cursor = self.con.cursor()
+    if ',' in column:
+      cursor.row_factory = None
+    return cursor.execute(query + ';', params)
+
+  def _fetchwords(self, wordids: List[int]) -> List[str]:
+    '''the words with these ids, in the same order'''
+    cursor = self.con.cursor()
+    cursor.row_factory = None
+    query = f"SELECT id, word FROM words WHERE id IN ({','.join('?' * len(wordids))});"
+    words = dict(cursor.execute(query, wordids).fetchall())
+    return [ words[wordid] for wordid in wordids ]
+
+  def _bestfirst(self, rows) -> Iterator[int]:
+    '''
+    the ids from rows of (id, score), which come best first, with each
+    run of equal scores shuffled into place as it gets taken, as in
+    Wordindex.bestfirst()
+    '''
+    for score, run in itertools.groupby(rows, key=lambda row: row[1]):
+      yield from _lazyshuffle([ wordid for wordid, score in run ], self.random)
+
+  def iterwords(self, desired_length: int, constraints: List[Tuple], minscore=None) -> Iterator[str]:
+    '''
+    the words that fit, one at a time, best first if the db has scores,
+    with ties in random order, otherwise all in random order.  Words
+    scoring under minscore are left out.
+
+    A caller that only tries the first few words only pays for those:
+    only the matching ids get read up front, or in a db with scores,
+    only as far as the scores tie, to be shuffled into place as they
+    are taken and their words fetched FETCH_WORDS at a time.  Schema 1
+    dbs have to be read in full.
+    '''
+    if not self.scored and minscore is not None and minscore > Wordfountain.DEFAULT_SCORE:
+      return
+    if self.schema < 2:
+      matches = self._query_schema1(desired_length, constraints)
+      self.random.shuffle(matches)
+      yield from matches
+      return
+    if self.scored:
+      wordids = self._bestfirst(self._query_schema2(
+        desired_length, constraints, minscore,
+        column=f'id, ifnull(score, {Wordfountain.DEFAULT_SCORE})'))
+    else:
+      wordids = _lazyshuffle(self._query_schema2(desired_length, constraints, column='id').fetchall(),
+                             self.random)
+    while chunk := list(itertools.islice(wordids, Wordfountain.FETCH_WORDS)):
+      yield from self._fetchwords(chunk)
+
+  def matchingwords(self, desired_length: int, constraints: List[Tuple], minscore=None) -> List:
+    '''
+    the words that fit, best first if the db has scores, with ties in
+    random order, otherwise all in random order.  Words scoring under
+    minscore are left out.
+    '''
+    return list(self.iterwords(desired_length, constraints, minscore))
 
 # end of class methods
 
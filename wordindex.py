@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+an in-memory word source with the same matchingwords() interface as
+Wordfountain, but answering constrained lookups with bitset ANDs
+instead of SQL table scans
+"""
+
+import os
+import random
+import time
+import sys
+import bisect
+import struct
+import sqlite3
+import pathlib
+from array import array
+from collections.abc import Sequence
+from typing import Iterator, List, Tuple, Optional
+import unidecode
+from mmapfile import writeatomic, openmapped
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+def _bitarray(bits: int):
+  '''
+  like _bitpositions(), but as a numpy array when numpy is around,
+  which is quicker to make, and to index other arrays with
+  '''
+  if np is None:
+    return _bitpositions(bits)
+  asbytes = np.frombuffer(bits.to_bytes((bits.bit_length()+7)//8, 'little'), dtype=np.uint8)
+  return np.flatnonzero(np.unpackbits(asbytes, bitorder='little'))
+
+def _bitpositions(bits: int) -> List[int]:
+  '''
+  the indexes of the set bits in bits, lowest first
+  '''
+  if np is not None:
+    return _bitarray(bits).tolist()
+  positions = []
+  s = bin(bits)[:1:-1]      # reversed, so s[i] is bit i
+  i = s.find('1')
+  while i != -1:
+    positions.append(i)
+    i = s.find('1', i+1)
+  return positions
+
+def _lazyshuffle(items: List, rng=random) -> Iterator:
+  '''
+  the items in random order, shuffling them in place only as far as
+  they get taken: one Fisher-Yates step for each item yielded
+  '''
+  for i in range(len(items)):
+    j = rng.randrange(i, len(items))
+    items[i], items[j] = items[j], items[i]
+    yield items[i]
+
+class _Wordrows(Sequence):
+  '''
+  the words of one length in a compiled word index, as a list-like view
+  of their fixed-width rows of letters, decoded only when asked for
+  '''
+  def __init__(self,buf,length,count):
+    self.buf = buf
+    self.length = length
+    self.count = count
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self,i):
+    if isinstance(i,slice):
+      return [ self[j] for j in range(*i.indices(self.count)) ]
+    if i < 0:
+      i += self.count
+    if not 0 <= i < self.count:
+      raise IndexError('word number out of range')
+    return str(self.buf[i*self.length:(i+1)*self.length], 'latin-1')
+
+class _Compiledbits(dict):
+  '''
+  Wordindex.bits for a compiled word index: each length's bitsets get
+  made out of the file's bitmaps the first time that length is asked for
+  '''
+  def __init__(self,index):
+    super().__init__()
+    self.index = index
+
+  def __missing__(self,length):
+    positions = self.index.readbits(length)
+    self[length] = positions
+    return positions
+
+class Wordindex:
+  '''
+  For every word length we keep the list of words of that length, and
+  for every (length, position, letter) a python int used as a bitset:
+  bit i is set when word i of that length has that letter at that position.
+  A constrained lookup is then one AND per constraint.
+
+  With numpy around, each length's words are also kept as a 2-D uint8
+  matrix of letter codes, one row per word, so that rating candidates
+  works on whole columns at once.
+
+  Words can come with scores, as in WORD;SCORE lists.  If any do, the
+  index is scored: each length's words are numbered best first, so the
+  set bits of a bitset are already in the order to try them, and a
+  minimum score is just a cap on word numbers.  Ties get numbered in a
+  fixed order, the same whatever the seed, so that indexes loaded in
+  different processes agree; bestfirst() shuffles them when they get
+  handed out instead.  Words without a score in a scored list get
+  DEFAULT_SCORE.
+
+  An index can be compiled into a file, by writeindex() or by
+  write-word-db.py --index, and opened with fromindexfile(), which
+  mmaps it rather than reading it: the words, the numpy matrix and the
+  scores stay in the file, and worker processes opening the same file
+  share one copy of those in the page cache.  The bitsets are another
+  matter: the search needs them as python ints, so the first lookup
+  of a length copies that length's bitmaps out of the file, and every
+  process ends up with its own copy of the ones it uses.  They are
+  most of the file (for a million words, 25 of 34 MB), so what the
+  file saves a worker is mostly the time it would take to build them,
+  not the memory.  A Wordindex opened from a file pickles as its
+  filename.
+
+  The file is a HEADER, then a LENGTH entry for each word length, then
+  for each length at the LENGTH entry's offset: the letters used in its
+  words (its alphabet), its words as rows of letters, its scores as
+  32-bit ints if the index is scored, and a bitmap for every position
+  and every letter of the alphabet, in that order, each bitmap
+  (words+7)//8 bytes, little-endian.
+  '''
+  DEFAULT_SCORE = 50
+
+  # how many candidates ranked() sorts to begin with; a search usually
+  # moves on, forward or back, long before it gets through them
+  RANK_CHUNK = 16
+
+  MAGIC = b'GCWI'
+  VERSION = 1
+  HEADER = struct.Struct('<4sIII')      # magic, version, lengths, scored
+  LENGTH = struct.Struct('<IIIQ')       # length, words, letters in its alphabet, offset
+
+  def __init__(self,seed=0):
+    self.words = {}     # length -> [ word, ... ]
+    self.bits = {}      # length -> [ { letter: bitset }, ... ] one dict per position
+    self.full = {}      # length -> bitset with a bit for every word of that length
+    self.matrix = {}    # length -> numpy uint8 array, words x letters
+    self.scores = {}    # length -> [ score, ... ] highest first, if scored
+    self.scored = False
+    self.indexfile = None   # the compiled index this was opened from, if it was
+    self.minscore = None
+    self.buf = None         # the compiled index, if it is one
+    self.layout = {}        # length -> (alphabet, words, offset of its bitmaps) in it
+    self.ties = {}          # length -> tieruns(length), once asked for
+    # a generator of its own, so that seeding one index doesn't reseed
+    # anything else in the process
+    self.random = random.Random(Wordindex.clockseed() if seed == 0 else seed)
+
+  @staticmethod
+  def clockseed():
+    '''what a seed of 0 means'''
+    return int(time.time())
+
+  @staticmethod
+  def splitscore(line: str) -> Tuple[str, Optional[int]]:
+    '''WORD;SCORE as (WORD, SCORE), and plain WORD as (WORD, None)'''
+    word, semicolon, score = line.partition(';')
+    if not semicolon:
+      return word, None
+    try:
+      return word, int(score)
+    except ValueError:
+      raise RuntimeError(f'bad score in word list line {line.strip()}') from None
+
+  @classmethod
+  def fromwords(cls,words,seed=0,minscore=None):
+    '''
+    Build an index from an iterable of words, each either a string,
+    maybe WORD;SCORE, or a (word, score or None) tuple.  With minscore,
+    words scoring less are left out.
+    '''
+    index = cls(seed=seed)
+    entries = {}        # word -> score, in the order first seen
+    for entry in words:
+      word, score = Wordindex.splitscore(entry) if isinstance(entry,str) else entry
+      word = word.strip().upper()
+      if not word or ' ' in word:
+        continue
+      if score is not None:
+        index.scored = True
+      if word not in entries or (score is not None and
+                                 (entries[word] is None or score > entries[word])):
+        entries[word] = score
+
+    bylength = {}
+    for word, score in entries.items():
+      if score is None:
+        score = Wordindex.DEFAULT_SCORE
+      bylength.setdefault(len(word),[]).append( (word, score) )
+    for length, pairs in bylength.items():
+      if index.scored:
+        # ties go in a shuffled order, but the same one whatever the
+        # seed: workers sharing one search have to number words alike
+        random.Random(length).shuffle(pairs)
+        pairs.sort(key=lambda pair: pair[1], reverse=True)
+      # leaving out the low scorers only after numbering the rest means
+      # they number the same as in a compiled index opened with minscore
+      if minscore is not None:
+        pairs = [ (word, score) for word, score in pairs if score >= minscore ]
+        if not pairs:
+          continue
+      if index.scored:
+        index.scores[length] = [ score for word, score in pairs ]
+      index.words[length] = [ word for word, score in pairs ]
+
+    index.buildbits()
+    return index
+
+  def buildbits(self):
+    '''the bitsets, and the numpy matrices, for the words in self.words'''
+    for length, wordlist in self.words.items():
+      positions = [ {} for i in range(length) ]
+      for wordno, word in enumerate(wordlist):
+        bit = 1 << wordno
+        for i,c in enumerate(word):
+          positions[i][c] = positions[i].get(c,0) | bit
+      self.bits[length] = positions
+      self.full[length] = (1 << len(wordlist)) - 1
+      if np is not None:
+        self.matrix[length] = np.frombuffer(''.join(wordlist).encode('latin-1'),
+                                            dtype=np.uint8).reshape(len(wordlist), length)
+
+  @classmethod
+  def fromwordlist(cls,filename,seed=0,minscore=None):
+    '''
+    build an index from a text file with one word per line, like
+    words.txt, or one WORD;SCORE per line
+    '''
+    try:
+      with open(filename,encoding='latin-1') as f:
+        return cls.fromwords((unidecode.unidecode(line) for line in f),
+                             seed=seed,minscore=minscore)
+    except OSError as e:
+      raise RuntimeError(f'Could not read words from {filename}') from e
+
+  @classmethod
+  def fromdb(cls,worddb,seed=0,minscore=None):
+    '''
+    build an index from a word database written by write-word-db.py,
+    or without one, from the one named by $CROSSWORD_WORDDB, as for
+    Wordfountain
+    '''
+    if not worddb:
+      worddb = os.environ.get('CROSSWORD_WORDDB')
+    if not worddb:
+      raise RuntimeError('no word list or word db given, and CROSSWORD_WORDDB isn\'t set')
+    assert isinstance(worddb, str), \
+      "word db filename must be a string"
+    con = sqlite3.connect(pathlib.Path(worddb).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+      if con.execute('PRAGMA user_version;').fetchone()[0] >= 3:
+        words = con.execute('SELECT word, score FROM words;').fetchall()
+      else:
+        words = [ (row[0], None) for row in con.execute('SELECT word FROM words;') ]
+    finally:
+      con.close()
+    return cls.fromwords(words,seed=seed,minscore=minscore)
+
+  def tobytes(self) -> bytes:
+    '''the index in the compiled form fromindexfile() reads'''
+    lengths = sorted(self.words)
+    offset = Wordindex.HEADER.size + Wordindex.LENGTH.size * len(lengths)
+    table, blocks = [], []
+    for length in lengths:
+      words = self.words[length]
+      positions = self.bits[length]
+      alphabet = sorted(set().union(*positions))
+      block = bytearray(''.join(alphabet).encode('latin-1'))
+      block += ''.join(words).encode('latin-1')
+      block += bytes(-len(block) % 4)
+      if self.scored:
+        block += array('i', self.scores[length]).tobytes()
+      nbytes = (len(words)+7) // 8
+      for position in positions:
+        for letter in alphabet:
+          block += position.get(letter,0).to_bytes(nbytes, 'little')
+      block += bytes(-len(block) % 8)
+      table.append(Wordindex.LENGTH.pack(length, len(words), len(alphabet), offset))
+      blocks.append(block)
+      offset += len(block)
+    header = Wordindex.HEADER.pack(Wordindex.MAGIC, Wordindex.VERSION, len(lengths), self.scored)
+    return header + b''.join(table) + b''.join(blocks)
+
+  def writeindex(self,filename):
+    '''compile the index into filename, for fromindexfile()'''
+    writeatomic(filename, self.tobytes())
+
+  @staticmethod
+  def iscompiled(filename) -> bool:
+    '''whether filename is a compiled word index, rather than a word list'''
+    try:
+      with open(filename,'rb') as f:
+        return f.read(len(Wordindex.MAGIC)) == Wordindex.MAGIC
+    except OSError:
+      return False
+
+  @classmethod
+  def frombuffer(cls,buf,seed=0,minscore=None):
+    '''
+    An index reading its words straight out of buf, which holds a
+    compiled index, such as an mmap of one.  With minscore, words
+    scoring less are left out.
+    '''
+    magic, version, nlengths, scored = Wordindex.HEADER.unpack_from(buf)
+    if magic != Wordindex.MAGIC or version != Wordindex.VERSION:
+      raise RuntimeError('not a compiled word index, or one from a different version')
+    index = cls(seed=seed)
+    index.scored = bool(scored)
+    index.minscore = minscore
+    index.buf = memoryview(buf)
+    index.layout = {}
+    index.bits = _Compiledbits(index)
+    for n in range(nlengths):
+      length, count, nletters, offset = Wordindex.LENGTH.unpack_from(
+        buf, Wordindex.HEADER.size + n * Wordindex.LENGTH.size)
+      alphabet = str(index.buf[offset:offset+nletters], 'latin-1')
+      wordsat = offset + nletters
+      scoresat = wordsat + count*length
+      scoresat += -scoresat % 4
+      bitsat = scoresat + 4*count*index.scored
+      if index.scored:
+        index.scores[length] = index.buf[scoresat:bitsat].cast('i')
+      index.layout[length] = (alphabet, count, bitsat)
+      # the words scoring at least minscore are the first so many, and
+      # those are all this index gets to see
+      index.full[length] = (1 << count) - 1
+      if minscore is not None:
+        index.full[length] &= index.scorecut(length, minscore)
+      count = index.full[length].bit_length()
+      if index.scored:
+        index.scores[length] = index.scores[length][:count]
+      index.words[length] = _Wordrows(index.buf[wordsat:], length, count)
+      if np is not None:
+        index.matrix[length] = np.frombuffer(index.buf, dtype=np.uint8, count=count*length,
+                                             offset=wordsat).reshape(count, length)
+    return index
+
+  def readbits(self, desired_length: int) -> List:
+    '''
+    a length's { letter: bitset } dicts, copied out of a compiled index
+    into this process's memory
+    '''
+    alphabet, count, offset = self.layout[desired_length]
+    full = self.full[desired_length]
+    nbytes = (count+7) // 8
+    positions = []
+    for position in range(desired_length):
+      letters = {}
+      for letter in alphabet:
+        if bits := int.from_bytes(self.buf[offset:offset+nbytes], 'little') & full:
+          letters[letter] = bits
+        offset += nbytes
+      positions.append(letters)
+    return positions
+
+  @classmethod
+  def fromindexfile(cls,filename,seed=0,minscore=None):
+    '''open a compiled index written by writeindex(), with mmap'''
+    try:
+      buf = openmapped(filename)
+    except OSError as e:
+      raise RuntimeError(f'Could not read the word index {filename}') from e
+    index = cls.frombuffer(buf,seed=seed,minscore=minscore)
+    index.indexfile = filename
+    return index
+
+  def __reduce_ex__(self,protocol):
+    # an index mapped from a file (see mmapfile) goes as the filename,
+    # for the other process to map again
+    if self.indexfile is not None:
+      return (Wordindex.fromindexfile, (self.indexfile, 0, self.minscore))
+    return super().__reduce_ex__(protocol)
+
+  def scorecut(self, desired_length: int, minscore: int) -> int:
+    '''
+    the bitset of words of the given length scoring at least minscore,
+    which in a scored index are the first so many
+    '''
+    if not self.scored:
+      return self.full.get(desired_length,0) if minscore <= Wordindex.DEFAULT_SCORE else 0
+    scores = self.scores.get(desired_length,[])
+    return (1 << bisect.bisect_right(scores, -minscore, key=lambda score: -score)) - 1
+
+  def tieruns(self, desired_length: int) -> List[int]:
+    '''
+    where each run of equally scored words starts, in a scored index's
+    numbering, followed by where the last one ends
+    '''
+    if desired_length not in self.ties:
+      scores = self.scores.get(desired_length,[])
+      self.ties[desired_length] = ([ 0 ] +
+                                   [ i for i in range(1,len(scores)) if scores[i] != scores[i-1] ] +
+                                   [ len(scores) ])
+    return self.ties[desired_length]
+
+  def bestfirst(self, desired_length: int, bits: int, rng=None) -> Iterator[int]:
+    '''
+    the word numbers in bits, one at a time, best first as a scored
+    index numbers them, but with each run of equally scored words in
+    random order, from rng or else the index's own generator.  Only the
+    runs actually reached get shuffled.
+    '''
+    rng = self.random if rng is None else rng
+    runs = self.tieruns(desired_length)
+    while bits:
+      low = (bits & -bits).bit_length() - 1
+      run = bits & ((1 << runs[bisect.bisect_right(runs, low)]) - 1)
+      bits ^= run
+      if run == 1 << low:
+        yield low
+      else:
+        yield from _lazyshuffle(_bitpositions(run), rng)
+
+  def candidates(self, desired_length: int, constraints: List[Tuple], minscore=None) -> int:
+    '''
+    the bitset of words of the given length that satisfy every
+    (position, letter) constraint, and score at least minscore
+    '''
+    if desired_length not in self.full:
+      return 0
+    result = self.full[desired_length]
+    if minscore is not None:
+      result &= self.scorecut(desired_length, minscore)
+    positions = self.bits[desired_length]
+    for c in constraints:
+      result &= positions[c[0]].get(c[1],0)
+      if not result:
+        break
+    return result
+
+  def ranked(self, desired_length: int, wordnos, weights: List, rng=None, jitter=1) -> Iterator[int]:
+    '''
+    wordnos (a list, or an array from _bitarray()) one at a time, best
+    first, where a word's rating is the sum over its positions of
+    weights[position][letter - 'A'], plus a random amount from 0 up to
+    jitter, from rng or else the index's own generator.  Ratings are
+    whole numbers, so a jitter of 1 only breaks ties.
+
+    The ratings all get worked out now, with numpy, but the words only
+    get sorted as far as they are taken: RANK_CHUNK of them at first,
+    and twice as many each time after that.
+    '''
+    rng = self.random if rng is None else rng
+    if np is None or not len(wordnos):
+      words = self.words[desired_length]
+      def _rater(wordno):
+        score = 0
+        for i,c in enumerate(words[wordno]):
+          score += weights[i][ord(c)-ord('A')]
+        return score + jitter * rng.random()
+      return iter(sorted(wordnos, key=_rater, reverse=True))
+
+    # a weight for every possible byte, so the gather can't go out of range
+    weightmatrix = np.zeros((desired_length, 256), dtype=np.int64)
+    weightmatrix[:, ord('A'):ord('A')+26] = weights
+    ids = np.asarray(wordnos)
+    ratings = weightmatrix[np.arange(desired_length), self.matrix[desired_length][ids]].sum(axis=1)
+    noise = np.random.default_rng(rng.getrandbits(64)).random(len(ids))
+    return Wordindex._bykey(ids, ratings + jitter * noise)
+
+  @staticmethod
+  def _bykey(ids, keys) -> Iterator[int]:
+    '''ids one at a time, highest key first, sorting only as far as they get taken'''
+    chunk = Wordindex.RANK_CHUNK
+    while len(ids) > chunk:
+      top = np.argpartition(-keys, chunk-1)[:chunk]
+      top = top[np.argsort(-keys[top])]
+      yield from ids[top].tolist()
+      ids = np.delete(ids, top)
+      keys = np.delete(keys, top)
+      chunk *= 2
+    yield from ids[np.argsort(-keys)].tolist()
+
+  def iterwords(self, desired_length: int, constraints: List[Tuple], minscore=None) -> Iterator[str]:
+    '''
+    the words that fit, one at a time, best first if the index is
+    scored, with ties in random order, otherwise all in random order.
+    Only the words actually taken get looked up (or shuffled into
+    place).
+    '''
+    bits = self.candidates(desired_length, constraints, minscore)
+    if not bits:
+      return
+    wordlist = self.words[desired_length]
+    if self.scored:
+      wordnos = self.bestfirst(desired_length, bits)
+    else:
+      wordnos = _lazyshuffle(_bitpositions(bits), self.random)
+    for wordno in wordnos:
+      yield wordlist[wordno]
+
+  def matchingwords(self, desired_length: int, constraints: List[Tuple], minscore=None) -> List:
+    '''
+    the words that fit, best first if the index is scored, with ties
+    in random order, otherwise all in random order
+    '''
+    return list(self.iterwords(desired_length, constraints, minscore))
+
+# end of class methods
+
+def main():
+  """for testing"""
+  if len(sys.argv) == 1:
+    sourcefile = "words.txt"
+  else:
+    sourcefile = sys.argv[1]
+
+  if sourcefile.endswith('.db'):
+    wi = Wordindex.fromdb(sourcefile,seed=0)
+  elif Wordindex.iscompiled(sourcefile):
+    wi = Wordindex.fromindexfile(sourcefile,seed=0)
+  else:
+    wi = Wordindex.fromwordlist(sourcefile,seed=0)
+
+  for length in sorted(wi.words):
+    print(f'{len(wi.words[length])} words of length {length}')
+
+  constraintlist = [ [ 1, 'I' ] ]
+  print(wi.matchingwords(3,constraintlist))
+
+if __name__ == '__main__':
+  main()
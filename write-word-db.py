@@ -1,72 +1,201 @@
 #!/usr/bin/env python3
 
 import sqlite3
+import os
 import os.path
 import sys
+import time
 import argparse
+import itertools
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 import unidecode
+from wordindex import Wordindex
 
-MAX_TO_INDEX = 8
-
-def _explode_word(word):
-  mylist = list(word)
-  while len(mylist) < MAX_TO_INDEX:
-    mylist.append('_')
-  return mylist[:MAX_TO_INDEX]
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-o', '--output')
-parser.add_argument('-f', '--force', action='store_true')
-parser.add_argument('infile',type=argparse.FileType('r', encoding='latin-1'))
-
-args = parser.parse_args()
-infilename = args.infile.name
-outfilename = args.output
-print(vars(args))
-
-assert infilename is not None
-
-if not os.path.exists(infilename):
-  print(f'input file {infilename} doesn\'t exist')
-  sys.exit(1)
-
-if outfilename is None:
-  if infilename.rfind('.txt') == -1:
-    outfilename = infilename + '.db'
-  else:
-    outfilename = (infilename[::-1].replace('txt.','bd.',1))[::-1]
-
-
-if os.path.exists(outfilename) and not args.force:
-  print(f'output file {outfilename} exists (-f to clobber)')
-  sys.exit(1)
-
-con = sqlite3.connect(outfilename)
-con.execute('''CREATE TABLE words
-               (word text NOT NULL, length INTEGER, 
-                c0 TEXT,
-                c1 TEXT,
-                c2 TEXT,
-                c3 TEXT,
-                c4 TEXT,
-                c5 TEXT,
-                c6 TEXT,
-                c7 TEXT )''')
-
-sql_ddl = ("INSERT INTO words VALUES (?, ?, " +
-           "?, ?, ?, ?, ?, ?, ?, ?)" )
-
-cur = con.cursor()
-while True:
-  line = unidecode.unidecode(args.infile.readline()).strip()
-  if ' ' in line:
-    print(f'skipping {line} because spaces bad')
-    continue
-  line = line.upper()
-  if not line:
-    break
-  print(f'writing {line}')
-  cur.execute(sql_ddl, (line,len(line), *_explode_word(line)))
-
-con.commit()
-con.close()
+# schema 1 stored the first 8 letters of each word in columns c0..c7.
+# schema 2 stores one row per letter in a letters table, so words of any
+# length can be constrained at any position, and indexes it by
+# (length, position, letter).
+# schema 3 adds a score for each word, from WORD;SCORE lines, or NULL
+# for words that came without one.
+SCHEMA_VERSION = 3
+
+# how many lines of the word list go to a worker at a time
+CHUNK_LINES = 50000
+
+def _normalize(lines, filters):
+  '''
+  Runs in a worker process: (word, score or None) for each line of a
+  chunk of a word list, WORD or WORD;SCORE, that gets through filters,
+  which are (minimum length, maximum length or None, allowed characters
+  or None, minimum score or None).  Also returns a Counter of why the
+  other lines didn't.  Raises RuntimeError on a line with a score that
+  isn't a number, as Wordindex.splitscore() does.
+  '''
+  minlength, maxlength, allowed, minscore = filters
+  words = []
+  skipped = Counter()
+  # one unidecode call for the whole chunk is much quicker than one a line
+  for line in unidecode.unidecode(''.join(lines)).splitlines():
+    # the same parsing as -w, so a bad score is an error here too
+    word, score = Wordindex.splitscore(line.strip())
+    if ' ' in word:
+      skipped['spaces'] += 1
+      continue
+    word = word.upper()
+    if not word:
+      skipped['blank'] += 1
+      continue
+    if len(word) < minlength or (maxlength is not None and len(word) > maxlength):
+      skipped['length'] += 1
+    elif allowed is not None and not allowed.issuperset(word):
+      skipped['characters'] += 1
+    elif minscore is not None and (Wordindex.DEFAULT_SCORE if score is None else score) < minscore:
+      skipped['score'] += 1
+    else:
+      words.append( (word, score) )
+  return words, skipped
+
+def _chunks(infile, size):
+  while chunk := list(itertools.islice(infile, size)):
+    yield chunk
+
+def _readwords(infile, filters, jobs):
+  '''
+  the _normalize()d chunks of infile, in order.  With more than one
+  job, a process pool normalizes them, with only a few chunks in flight
+  at a time so the file never has to be in memory all at once.
+  '''
+  if jobs == 1:
+    for chunk in _chunks(infile, CHUNK_LINES):
+      yield _normalize(chunk, filters)
+    return
+  with ProcessPoolExecutor(max_workers=jobs) as pool:
+    pending = deque()
+    for chunk in _chunks(infile, CHUNK_LINES):
+      pending.append(pool.submit(_normalize, chunk, filters))
+      if len(pending) >= 2*jobs:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+def main():
+  """build a word db from a word list"""
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-o', '--output')
+  parser.add_argument('-f', '--force', action='store_true')
+  parser.add_argument('--index', metavar='FILE',
+                      help='also compile the words into a word index FILE, which loads much faster with -w')
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                      help='normalize the words with this many worker processes')
+  parser.add_argument('--min-length', type=int, default=1,
+                      help='leave out words shorter than this')
+  parser.add_argument('--max-length', type=int,
+                      help='leave out words longer than this')
+  parser.add_argument('--allowed', metavar='CHARACTERS',
+                      help='leave out words with characters not in CHARACTERS, e.g. ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+  parser.add_argument('--min-score', type=int,
+                      help=f'leave out words scoring less than this (words without a score count as {Wordindex.DEFAULT_SCORE})')
+  parser.add_argument('infile',type=argparse.FileType('r', encoding='latin-1'))
+
+  args = parser.parse_args()
+  infilename = args.infile.name
+  outfilename = args.output
+  print(vars(args))
+
+  assert infilename is not None
+
+  if not os.path.exists(infilename):
+    print(f'input file {infilename} doesn\'t exist')
+    sys.exit(1)
+
+  if args.jobs < 1:
+    parser.error('--jobs must be at least 1')
+
+  if outfilename is None:
+    if infilename.rfind('.txt') == -1:
+      outfilename = infilename + '.db'
+    else:
+      outfilename = (infilename[::-1].replace('txt.','bd.',1))[::-1]
+
+
+  if os.path.exists(outfilename) and not args.force:
+    print(f'output file {outfilename} exists (-f to clobber)')
+    sys.exit(1)
+
+  if os.path.exists(outfilename):
+    os.remove(outfilename)
+
+  started = time.perf_counter()
+  allowed = None if args.allowed is None else frozenset(args.allowed.upper())
+  filters = (args.min_length, args.max_length, allowed, args.min_score)
+
+  con = sqlite3.connect(outfilename)
+  # nothing to recover if the build dies halfway, so no journal and no
+  # waiting for the disk
+  con.execute('PRAGMA journal_mode = OFF')
+  con.execute('PRAGMA synchronous = OFF')
+  skipped = Counter()
+  accepted = 0
+  try:
+    with con:
+      con.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+      con.execute('''CREATE TABLE words
+                     (id INTEGER PRIMARY KEY,
+                      word TEXT NOT NULL UNIQUE,
+                      length INTEGER NOT NULL,
+                      score INTEGER)''')
+      con.execute('''CREATE TABLE letters
+                     (length INTEGER NOT NULL,
+                      position INTEGER NOT NULL,
+                      letter TEXT NOT NULL,
+                      wordid INTEGER NOT NULL REFERENCES words(id))''')
+      # each chunk goes straight in, so only a chunk at a time is ever
+      # in memory; a word listed more than once keeps its best score
+      for words, skips in _readwords(args.infile, filters, args.jobs):
+        skipped.update(skips)
+        accepted += len(words)
+        con.executemany('''INSERT INTO words (word, length, score) VALUES (?, length(?), ?)
+                           ON CONFLICT (word) DO UPDATE SET score =
+                             CASE WHEN excluded.score IS NULL THEN score
+                                  WHEN score IS NULL THEN excluded.score
+                                  ELSE max(score, excluded.score) END''',
+                        ( (word, word, score) for word, score in words ))
+      read = time.perf_counter()
+      # one row per letter, made by sqlite from the words table
+      con.execute('''INSERT INTO letters
+                     WITH RECURSIVE positions(position) AS
+                       (SELECT 0 UNION ALL SELECT position+1 FROM positions
+                        WHERE position+1 < (SELECT max(length) FROM words))
+                     SELECT length, position, substr(word, position+1, 1), id
+                     FROM words JOIN positions ON position < length''')
+      # building the indexes after the bulk insert is much faster than
+      # maintaining them row by row
+      con.execute('CREATE INDEX words_by_length ON words (length, score)')
+      con.execute('''CREATE INDEX letters_by_pattern
+                     ON letters (length, position, letter, wordid)''')
+  except RuntimeError as e:
+    con.close()
+    os.remove(outfilename)
+    print(f'{infilename}: {e}')
+    sys.exit(1)
+
+  con.execute('ANALYZE')
+  written = con.execute('SELECT count(*) FROM words').fetchone()[0]
+  finished = time.perf_counter()
+
+  duplicates = accepted - written
+  lines = accepted + sum(skipped.values())
+  print(', '.join([ f'read {lines} lines in {read - started:.2f}s '
+                    f'({lines / max(read - started, 1e-9):.0f} lines/s)',
+                    f'{duplicates} duplicates' ] +
+                  [ f'{n} skipped for {reason}' for reason, n in sorted(skipped.items()) ]))
+  print(f'wrote {written} words to {outfilename} in {finished - read:.2f}s')
+
+  if args.index is not None:
+    Wordindex.fromwords(con.execute('SELECT word, score FROM words ORDER BY id')).writeindex(args.index)
+    print(f'compiled them into {args.index}')
+  con.close()
+
+if __name__ == '__main__':
+  main()